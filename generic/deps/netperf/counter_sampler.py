@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""
+Sample network related counters at a fixed interval.
+
+Every interval one line is printed with the sample time and all counters
+read in a single pass, e.g.:
+
+    1400000000.12 rx_pkts=10 tx_pkts=12 rx_intr_0=3 tx_intr_0=4 re_pkts=0
+
+The sampler runs until it is killed.
+"""
+
+import re
+import sys
+import time
+import getopt
+
+
+def usage():
+    print """counter sampler usage:
+    %s [-i interval] [-n iface] [-q irq_regex,...] [-t] [-k]
+
+    -i interval: seconds between two samples, default 1
+    -n iface: read rx/tx packets and bytes of this interface
+    -q irq_regex: per queue interrupts, e.g. virtio.-input,virtio.-output
+    -t: read the TCP retransmitted segments from /proc/net/snmp
+    -k: read io_exits and irq_injections from the kvm debugfs""" % sys.argv[0]
+
+
+def read_file(path):
+    f = open(path)
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def read_iface(iface, sample):
+    path = "/sys/class/net/%s/statistics/%s"
+    for key, name in (("rx_pkts", "rx_packets"), ("tx_pkts", "tx_packets"),
+                      ("rx_byts", "rx_bytes"), ("tx_byts", "tx_bytes")):
+        sample[key] = int(read_file(path % (iface, name)))
+
+
+def read_interrupts(irqs, sample):
+    lines = read_file("/proc/interrupts").splitlines()
+    ncpu = len(lines[0].split())
+    for prefix, regex in irqs:
+        total = 0
+        queue = 0
+        for line in lines[1:]:
+            if not re.search(regex, line):
+                continue
+            count = sum([int(_) for _ in line.split()[1:ncpu + 1]])
+            sample["%s_intr_%s" % (prefix, queue)] = count
+            total += count
+            queue += 1
+        sample["%s_intr_sum" % prefix] = total
+
+
+def read_retrans(sample):
+    tcp = [_ for _ in read_file("/proc/net/snmp").splitlines()
+           if _.startswith("Tcp:")]
+    keys, values = tcp[0].split(), tcp[1].split()
+    sample["re_pkts"] = int(values[keys.index("RetransSegs")])
+
+
+def read_kvm(sample):
+    path = "/sys/kernel/debug/kvm/%s"
+    sample["io_exit"] = int(read_file(path % "io_exits"))
+    sample["irq_inj"] = int(read_file(path % "irq_injections"))
+
+
+def main():
+    try:
+        opts, _ = getopt.getopt(sys.argv[1:], "i:n:q:tk")
+    except getopt.GetoptError:
+        usage()
+        sys.exit(1)
+
+    interval = 1.0
+    iface = None
+    irqs = []
+    retrans = False
+    kvm = False
+    for opt, value in opts:
+        if opt == "-i":
+            interval = float(value)
+        elif opt == "-n":
+            iface = value
+        elif opt == "-q":
+            for regex in value.split(","):
+                # virtio.-input -> rx, virtio.-output -> tx
+                prefix = "input" in regex and "rx" or "tx"
+                irqs.append((prefix, regex))
+        elif opt == "-t":
+            retrans = True
+        elif opt == "-k":
+            kvm = True
+
+    next_sample = time.time()
+    while True:
+        sample = {}
+        now = time.time()
+        if iface:
+            read_iface(iface, sample)
+        if irqs:
+            read_interrupts(irqs, sample)
+        if retrans:
+            read_retrans(sample)
+        if kvm:
+            read_kvm(sample)
+        items = ["%s=%s" % (k, v) for k, v in sorted(sample.items())]
+        sys.stdout.write("%.3f %s\n" % (now, " ".join(items)))
+        sys.stdout.flush()
+        next_sample += interval
+        time.sleep(max(0, next_sample - time.time()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+netperf agent: start parallel netperf clients and forward their output.
+
+Every line printed by the netperf clients is echoed to stdout. When a
+collector address is given with --report, each line is also pushed to the
+collector over a persistent TCP connection as "<session> <line>", so the
+test host sees the interim results the moment they are produced.
+"""
+
+import socket
+import subprocess
+import sys
+import threading
+import getopt
+
+
+def usage():
+    print """netperf agent usage:
+    %s [--report host:port] [session_number] [netperf_path] [netperf_params]
+
+    --report host:port: stream every output line to this collector
+    $session_number: number of client sessions
+    $netperf_path: client path
+    $netperf_params: netperf parameters string""" % sys.argv[0]
+
+
+class Reporter(object):
+
+    def __init__(self, address):
+        self.lock = threading.Lock()
+        self.sock = None
+        if address:
+            host, port = address.rsplit(":", 1)
+            self.sock = socket.create_connection((host, int(port)))
+
+    def report(self, index, line):
+        self.lock.acquire()
+        try:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+            if self.sock:
+                try:
+                    self.sock.sendall("%d %s" % (index, line))
+                except socket.error:
+                    # Keep the clients running and the local copy complete
+                    # even if the collector went away.
+                    self.sock.close()
+                    self.sock = None
+        finally:
+            self.lock.release()
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+
+
+def forward(index, proc, reporter):
+    for line in iter(proc.stdout.readline, ""):
+        reporter.report(index, line)
+    proc.wait()
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "", ["report="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(1)
+    if len(args) < 3:
+        usage()
+        sys.exit(1)
+
+    address = dict(opts).get("--report")
+    sessions = int(args[0])
+    cmd = "%s %s" % (args[1], " ".join(args[2:]))
+
+    reporter = Reporter(address)
+    threads = []
+    for index in range(sessions):
+        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        thread = threading.Thread(target=forward,
+                                  args=(index, proc, reporter))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    reporter.close()
+
+
+if __name__ == "__main__":
+    main()
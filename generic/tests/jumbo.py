@@ -4,6 +4,45 @@ import random
 from autotest.client.shared import error
 from autotest.client import utils
 from virttest import utils_misc, utils_test, utils_net
+from provider import perf_report
+
+
+def parse_snmp(output):
+    """
+    Parse the content of /proc/net/snmp
+
+    :return: dict of "Proto.Counter" to value
+    """
+    counters = {}
+    lines = output.splitlines()
+    for header, values in zip(lines[::2], lines[1::2]):
+        proto = header.split(":")[0]
+        for name, value in zip(header.split()[1:], values.split()[1:]):
+            counters["%s.%s" % (proto, name)] = int(value)
+    return counters
+
+
+def snmp_frags_drops(before, after):
+    """
+    Return the fragmentation and the drop counters increase of two
+    /proc/net/snmp snapshots.
+    """
+    def delta(keys):
+        return sum([after.get(_, 0) - before.get(_, 0) for _ in keys])
+    frags = delta(["Ip.FragCreates", "Ip.ReasmReqds"])
+    drops = delta(["Ip.InDiscards", "Ip.OutDiscards", "Ip.FragFails",
+                   "Ip.ReasmFails", "Udp.RcvbufErrors", "Udp.SndbufErrors"])
+    return frags, drops
+
+
+def get_host_cpu_jiffies():
+    """
+    Return the busy and total jiffies of all cpus in host /proc/stat
+    """
+    values = [int(_) for _ in
+              utils.read_one_line("/proc/stat").split()[1:]]
+    # idle and iowait are the 4th and 5th values
+    return sum(values) - values[3] - values[4], sum(values)
 
 
 @error.context_aware
@@ -22,6 +61,8 @@ def run(test, params, env):
     9) Verify the path MTU.
     10) Recover the MTU.
 
+    With mtu_sweep = yes steps 2 to 10 are replaced by a MTU sweep.
+
     :param test: QEMU test object.
     :param params: Dictionary with the test parameters.
     :param env: Dictionary with test environment.
@@ -45,6 +86,13 @@ def run(test, params, env):
     if guest_ip is None:
         raise error.TestError("Could not get the guest ip address")
 
+    if params.get("mtu_sweep", "no") == "yes":
+        try:
+            mtu_sweep(test, params, vm, session, ifname)
+        finally:
+            session.close()
+        return
+
     try:
         error.context("Changing the MTU of guest", logging.info)
         # Environment preparation
@@ -172,3 +220,89 @@ def run(test, params, env):
         if utils.system("grep '%s.*%s' /proc/net/arp" % (guest_ip, ifname)) == '0':
             utils.run("arp -d %s -i %s" % (guest_ip, ifname))
             logging.info("Removing the temporary ARP entry successfully")
+
+
+def mtu_sweep(test, params, vm, session, ifname):
+    """
+    Measure the throughput of host and guest for a list of MTUs
+
+    :param vm: netperf client vm
+    :param session: vm session
+    :param ifname: tap of the vm
+    """
+    bridge = params.get("netdst")
+    ethname = utils_net.get_linux_ifname(session, vm.get_mac_address(0))
+    host_ip = utils_net.get_host_ip_address(params)
+    host_shell = {"shell_client": params.get("shell_client", "ssh"),
+                  "shell_port": "22", "username": "root",
+                  "password": params.get("hostpasswd", "redhat")}
+    netperf_server, netperf_client = perf_report.netperf_pair(
+        params, host_ip, vm.get_address(0), server_shell=host_shell)
+    test_time = params.get("mtu_sweep_time", "30")
+    size = params.get("mtu_sweep_msg_size", "65536")
+    ncpu = utils.count_cpus()
+    session.cmd("iptables -F", ignore_all_errors=True)
+
+    host_ifaces = [ifname]
+    if bridge in utils_net.get_net_if():
+        host_ifaces.append(bridge)
+    orig_mtu = [utils.read_one_line("/sys/class/net/%s/mtu" % _).strip()
+                for _ in host_ifaces]
+    guest_orig_mtu = session.cmd_output("cat /sys/class/net/%s/mtu" %
+                                        ethname).strip()
+
+    def set_mtu(mtu, host_mtus=None, restore=False):
+        # the bridge mtu is capped by its ports, set the tap first
+        for iface, value in zip(host_ifaces, host_mtus or [mtu] * 2):
+            if utils.system("ifconfig %s mtu %s" % (iface, value),
+                            ignore_status=True):
+                if restore:
+                    logging.warn("Fail to restore mtu %s of %s", value,
+                                 iface)
+                    continue
+                # a point measured at another host mtu would be misreported
+                raise error.TestError("Fail to set mtu %s of %s" %
+                                      (value, iface))
+        session.cmd("ifconfig %s mtu %s" % (ethname, mtu))
+
+    table = perf_report.ResultTable(test, "mtu-sweep",
+                                    ["mtu", "protocol", "throughput",
+                                     "cpu_per_gbit", "host_frags",
+                                     "host_drops", "guest_frags",
+                                     "guest_drops"])
+    try:
+        netperf_server.start()
+        for mtu in params.get("mtu_sweep_list", "1500 4000 9000").split():
+            error.context("Set mtu %s of bridge, tap and guest" % mtu,
+                          logging.info)
+            set_mtu(mtu)
+            for protocol in ("TCP_STREAM", "TCP_MAERTS"):
+                error.context("Run %s with mtu %s" % (protocol, mtu),
+                              logging.info)
+                host_snmp = parse_snmp(utils.system_output("cat "
+                                                           "/proc/net/snmp"))
+                guest_snmp = parse_snmp(session.cmd_output("cat "
+                                                           "/proc/net/snmp"))
+                busy, total = get_host_cpu_jiffies()
+                throughput = perf_report.netperf_throughput(
+                    netperf_client, host_ip, test_time, protocol, size)
+                busy_end, total_end = get_host_cpu_jiffies()
+                row = {"mtu": int(mtu), "protocol": protocol,
+                       "throughput": throughput}
+                busy_cpus = ((busy_end - busy) * float(ncpu) /
+                             max(total_end - total, 1))
+                row["cpu_per_gbit"] = (busy_cpus * 1000 /
+                                       max(row["throughput"], 1))
+                row["host_frags"], row["host_drops"] = snmp_frags_drops(
+                    host_snmp, parse_snmp(utils.system_output(
+                        "cat /proc/net/snmp")))
+                row["guest_frags"], row["guest_drops"] = snmp_frags_drops(
+                    guest_snmp, parse_snmp(session.cmd_output(
+                        "cat /proc/net/snmp")))
+                table.add(row, "mtu-%s--%s" % (mtu, protocol),
+                          table.keys[2:])
+    finally:
+        perf_report.netperf_cleanup(netperf_server, netperf_client)
+        set_mtu(guest_orig_mtu, orig_mtu, restore=True)
+
+    table.log("MTU sweep (Mbit/s, cpus per Gbit/s)")
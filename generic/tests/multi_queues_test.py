@@ -6,6 +6,31 @@ from autotest.client import utils
 from virttest import utils_net, utils_misc, utils_test
 
 
+def get_virtio_queues_irq(session, direction="input"):
+    """
+    Return multi queues irq list of the given direction
+
+    :param session: guest session
+    :param direction: "input" or "output" queues
+    """
+    guest_irq_info = session.cmd_output("cat /proc/interrupts")
+    return re.findall(r"(\d+):.*virtio\d+-%s.\d" % direction, guest_irq_info)
+
+
+def spread_queues_irq(session, smp):
+    """
+    Bind the input and output irq of queue N to guest vcpu N % smp
+
+    :param session: guest session
+    :param smp: number of guest vcpus
+    """
+    cmd_set_cpu_affinity = "echo %x > /proc/irq/%s/smp_affinity"
+    for direction in ("input", "output"):
+        for index, irq in enumerate(get_virtio_queues_irq(session,
+                                                          direction)):
+            session.cmd(cmd_set_cpu_affinity % (1 << (index % smp), irq))
+
+
 @error.context_aware
 def run(test, params, env):
     """
@@ -22,13 +47,6 @@ def run(test, params, env):
     :param params: Dictionary with the test parameters.
     :param env: Dictionary with test environment.
     """
-    def get_virtio_queues_irq(session):
-        """
-        Return multi queues input irq list
-        """
-        guest_irq_info = session.cmd_output("cat /proc/interrupts")
-        return re.findall(r"(\d+):.*virtio\d+-input.\d", guest_irq_info)
-
     def get_cpu_affinity_hint(session, irq_number):
         """
         Return the cpu affinity_hint of irq_number
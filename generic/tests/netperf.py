@@ -4,9 +4,12 @@ import commands
 import threading
 import re
 import time
+import socket
 from autotest.client import utils
 from autotest.client.shared import error
 from virttest import utils_test, utils_misc, utils_net, remote, data_dir
+from provider import perf_stats, perf_report, thread_cpu
+from generic.tests import multi_queues_test
 
 
 def format_result(result, base="12", fbase="5"):
@@ -54,6 +57,140 @@ def netperf_record(results, filter_list, header=False, base="12", fbase="2"):
     return record, key_list
 
 
+class InterimCollector(object):
+
+    """
+    Collect the netperf interim results streamed by netperf_agent.py.
+
+    The agent connects back once and sends every netperf output line as
+    "<session> <line>". The collector notes when all sessions have started
+    and keeps the arrival time of each interim result, so the throughput can
+    be computed for the measurement window without re-reading any file.
+    """
+
+    def __init__(self, sessions, address, timeout=120):
+        """
+        :param sessions: number of netperf sessions the agent starts
+        :param address: host address the agent connects to
+        :param timeout: seconds to wait for the agent to connect
+        """
+        self.sessions = sessions
+        self.timeout = timeout
+        self.started = threading.Event()
+        self.results = {}
+        self.window = [None, None]
+        self._headers = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((address, 0))
+        self._sock.listen(1)
+        self._sock.settimeout(timeout)
+        self.port = self._sock.getsockname()[1]
+        self._thread = threading.Thread(target=self._receive)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _receive(self):
+        try:
+            self._conn, _ = self._sock.accept()
+        except socket.timeout:
+            logging.warn("netperf agent did not connect in %ss", self.timeout)
+            return
+        for line in self._conn.makefile():
+            self._handle(line)
+
+    def _handle(self, line):
+        try:
+            index, content = line.split(" ", 1)
+            index = int(index)
+        except ValueError:
+            return
+        now = time.time()
+        self._lock.acquire()
+        try:
+            if "MIGRATE" in content:
+                self._headers += 1
+                if self._headers >= self.sessions:
+                    self.started.set()
+            elif "Interim" in content:
+                value = re.findall(r"Interim result: *(\S+)", content)
+                if value:
+                    self.results.setdefault(index, []).append(
+                        (now, float(value[0])))
+        finally:
+            self._lock.release()
+
+    def wait_started(self, timeout):
+        """
+        Wait until all netperf sessions have printed their test header.
+        """
+        self.started.wait(timeout)
+        return self.started.is_set()
+
+    def start_window(self):
+        self.window[0] = time.time()
+
+    def stop_window(self):
+        self.window[1] = time.time()
+
+    def _window_results(self):
+        start, end = self.window
+        self._lock.acquire()
+        try:
+            window = {}
+            for index, values in self.results.items():
+                window[index] = [(t, v) for t, v in values
+                                 if (start is None or t >= start) and
+                                 (end is None or t <= end)]
+            return window
+        finally:
+            self._lock.release()
+
+    def throughput(self):
+        """
+        Sum of each session's average interim result in the window.
+        """
+        window = self._window_results()
+        values = [v for v in window.values() if v]
+        if len(values) < self.sessions:
+            raise error.TestError("We couldn't expect this parallism,"
+                                  "expect %s get %s" % (self.sessions,
+                                                        len(values)))
+        result = 0.0
+        for session_values in values:
+            result += sum([v for _, v in session_values]) / len(session_values)
+        return result
+
+    def series(self):
+        """
+        Aggregate interim results of all sessions per second of the window.
+        """
+        window = self._window_results()
+        start = self.window[0]
+        if start is None:
+            start = min([t for v in window.values() for t, _ in v] or [0])
+        buckets = {}
+        for index, values in window.items():
+            for t, v in values:
+                buckets.setdefault(int(t - start), {}).setdefault(
+                    index, []).append(v)
+        series = []
+        for second in sorted(buckets.keys()):
+            total = 0.0
+            for values in buckets[second].values():
+                total += sum(values) / len(values)
+            series.append(total)
+        return series
+
+    def close(self):
+        if self._conn:
+            self._conn.close()
+        self._sock.close()
+        self._thread.join(5)
+
+
 def start_netserver_win(session, start_cmd):
     check_reg = re.compile(r"NETSERVER.*EXE", re.I)
     if not check_reg.findall(session.cmd_output("tasklist")):
@@ -89,12 +226,14 @@ def run(test, params, env):
         download_dir = data_dir.get_download_dir()
         md5sum = params.get("pkg_md5sum")
         pkg = utils.unmap_url_cache(download_dir, download_link, md5sum)
-        remote.scp_to_remote(ip, shell_port, username, password, pkg, "/tmp")
+        remote.scp_to_remote(ip, port, user, password, pkg, "/tmp")
         ssh_cmd(session, params.get("setup_cmd"))
 
-        agent_path = os.path.join(test.virtdir, "scripts/netperf_agent.py")
-        remote.scp_to_remote(ip, shell_port, username, password,
-                             agent_path, "/tmp")
+        for script in ("netperf_agent.py", "counter_sampler.py"):
+            script_path = os.path.join(data_dir.get_deps_dir("netperf"),
+                                       script)
+            remote.scp_to_remote(ip, port, user, password, script_path,
+                                 "/tmp")
 
     def _pin_vm_threads(vm, node):
         if node:
@@ -104,6 +243,49 @@ def run(test, params, env):
 
         return node
 
+    def setup_shard(index, node):
+        """
+        Prepare the server/client VM pair of an extra shard and pin both
+        VMs to the given host numa node.
+
+        :param index: shard index, pair vms[2 * index], vms[2 * index + 1]
+        :param node: host numa node of the shard
+        """
+        server_vm = env.get_vm(vms_list[index * 2])
+        client_vm = env.get_vm(vms_list[index * 2 + 1])
+        shard = {"server": server_vm.wait_for_get_address(0, timeout=5),
+                 "server_ctl": server_vm.wait_for_login(timeout=login_timeout),
+                 "clients": [client_vm.wait_for_login(timeout=login_timeout)
+                             for _ in range(2)],
+                 "server_cyg": None, "server_vm": server_vm}
+        _pin_vm_threads(server_vm, node)
+        _pin_vm_threads(client_vm, node)
+        client_ip = client_vm.wait_for_get_address(0, timeout=5)
+        for session, ip, tag in ((shard["server_ctl"], shard["server"],
+                                  "server"),
+                                 (shard["clients"][0], client_ip, "client")):
+            params_tmp = params.object_params(tag)
+            env_setup(session, ip, params_tmp["username"],
+                      int(params_tmp["shell_port"]), params_tmp["password"])
+        return shard
+
+    vms_list = params["vms"].split()
+    netperf_shards = int(params.get("netperf_shards", 1))
+    shard_nodes = []
+    if netperf_shards > 1:
+        if params.get("host", "localhost") != "localhost":
+            raise error.TestNAError("Sharded netperf needs the local host")
+        if len(vms_list) < netperf_shards * 2:
+            raise error.TestNAError("Sharded netperf needs %s VM pairs, got "
+                                    "vms '%s'" % (netperf_shards,
+                                                  params["vms"]))
+        # same numbering as numa_node, NumaNode counts the nodes from 1
+        shard_nodes = params.get("shard_numa_nodes", "").split()
+        if not shard_nodes:
+            shard_nodes = [n + 1 for n in utils_misc.NumaInfo().online_nodes]
+        shard_nodes = [shard_nodes[i % len(shard_nodes)]
+                       for i in range(netperf_shards)]
+
     vm = env.get_vm(params["main_vm"])
     vm.verify_alive()
     login_timeout = int(params.get("login_timeout", 360))
@@ -132,6 +314,15 @@ def run(test, params, env):
 
     if params.get("rh_perf_envsetup_script"):
         utils_test.service_setup(vm, session, test.virtdir)
+
+    if queues > 1 and params.get("spread_queues_irq") == "yes":
+        # after the reboot, it resets the queues and the irq affinity
+        error.context("Spread queues irq over %s vcpus" % vm.cpuinfo.smp,
+                      logging.info)
+        ethname = utils_net.get_linux_ifname(session, vm.get_mac_address(0))
+        session.cmd("ethtool -L %s combined %s" % (ethname, queues))
+        session.cmd("service irqbalance stop", ignore_all_errors=True)
+        multi_queues_test.spread_queues_irq(session, int(vm.cpuinfo.smp))
     session.close()
 
     server_ip = vm.wait_for_get_address(0, timeout=5)
@@ -154,7 +345,10 @@ def run(test, params, env):
     logging.debug(commands.getoutput("numactl --hardware"))
     logging.debug(commands.getoutput("numactl --show"))
     # pin guest vcpus/memory/vhost threads to last numa node of host by default
-    numa_node = _pin_vm_threads(vm, params.get("numa_node"))
+    if shard_nodes:
+        numa_node = _pin_vm_threads(vm, shard_nodes[0])
+    else:
+        numa_node = _pin_vm_threads(vm, params.get("numa_node"))
 
     host = params.get("host", "localhost")
     host_ip = host
@@ -188,9 +382,11 @@ def run(test, params, env):
         clients.append(tmp)
     client = clients[0]
 
-    vms_list = params["vms"].split()
     if len(vms_list) > 1:
-        vm2 = env.get_vm(vms_list[-1])
+        if netperf_shards > 1:
+            vm2 = env.get_vm(vms_list[1])
+        else:
+            vm2 = env.get_vm(vms_list[-1])
         vm2.verify_alive()
         session2 = vm2.wait_for_login(timeout=login_timeout)
         if params.get("rh_perf_envsetup_script"):
@@ -214,17 +410,24 @@ def run(test, params, env):
 
     env.stop_tcpdump()
 
+    shards = []
+    for index in range(1, netperf_shards):
+        error.context("Prepare env of shard %s" % index, logging.info)
+        shards.append(setup_shard(index, shard_nodes[index]))
+
     error.context("Start netperf testing", logging.info)
-    start_test(server_ip, server_ctl, host, clients, test.resultsdir,
-               l=int(params.get('l')),
-               sessions_rr=params.get('sessions_rr'),
-               sessions=params.get('sessions'),
-               sizes_rr=params.get('sizes_rr'),
-               sizes=params.get('sizes'),
-               protocols=params.get('protocols'),
-               ver_cmd=params.get('ver_cmd', "rpm -q qemu-kvm"),
-               netserver_port=params.get('netserver_port', "12865"),
-               params=params, server_cyg=server_cyg, test=test)
+    records = start_test(server_ip, server_ctl, host, clients,
+                         test.resultsdir, l=int(params.get('l')),
+                         sessions_rr=params.get('sessions_rr'),
+                         sessions=params.get('sessions'),
+                         sizes_rr=params.get('sizes_rr'),
+                         sizes=params.get('sizes'),
+                         protocols=params.get('protocols'),
+                         ver_cmd=params.get('ver_cmd', "rpm -q qemu-kvm"),
+                         netserver_port=params.get('netserver_port',
+                                                   "12865"),
+                         params=params, server_cyg=server_cyg, test=test,
+                         shards=shards, server_vm=vm)
 
     if params.get("log_hostinfo_script"):
         src = os.path.join(test.virtdir, params.get("log_hostinfo_script"))
@@ -242,6 +445,8 @@ def run(test, params, env):
         logfile.write(output)
         logfile.close()
 
+    return records
+
 
 @error.context_aware
 def start_test(server, server_ctl, host, clients, resultsdir, l=60,
@@ -249,7 +454,8 @@ def start_test(server, server_ctl, host, clients, resultsdir, l=60,
                sizes_rr="64 256 512 1024 2048",
                sizes="64 256 512 1024 2048 4096",
                protocols="TCP_STREAM TCP_MAERTS TCP_RR TCP_CRR", ver_cmd=None,
-               netserver_port=None, params={}, server_cyg=None, test=None):
+               netserver_port=None, params={}, server_cyg=None, test=None,
+               shards=None, server_vm=None):
     """
     Start to test with different kind of configurations
 
@@ -268,10 +474,31 @@ def start_test(server, server_ctl, host, clients, resultsdir, l=60,
     :param netserver_port: netserver listen port
     :param params: Dictionary with the test parameters.
     :param server_cyg: shell session for cygwin in windows guest
+    :param shards: extra server/client pairs, dicts with server, server_ctl,
+                   clients, server_cyg and server_vm; the matrix points are
+                   spread over all pairs and run in parallel
+    :param server_vm: server VM object, its qemu threads CPU time is
+                      accounted per role when thread_cpu = yes
+    :return: list of (protocol, size, sessions, result dict) of every point
     """
 
+    shards = [{"server": server, "server_ctl": server_ctl,
+               "clients": clients, "server_cyg": server_cyg,
+               "server_vm": server_vm}] + (shards or [])
     guest_ver_cmd = params.get("guest_ver_cmd", "uname -r")
-    fd = open("%s/netperf-result.%s.RHS" % (resultsdir, time.time()), "w")
+    timestamp = time.time()
+    fd = open("%s/netperf-result.%s.RHS" % (resultsdir, timestamp), "w")
+    series_fd = None
+    counters_fd = None
+    # per second aggregated throughput of the interim results
+    if (params.get("interim_channel", "no") == "yes" or
+            params.get("adaptive_run", "no") == "yes"):
+        series_fd = open("%s/netperf-series.%s" % (resultsdir, timestamp),
+                         "w")
+    # per second guest/host counters
+    if params.get("counter_sampling", "no") == "yes":
+        counters_fd = open("%s/netperf-counters.%s" %
+                           (resultsdir, timestamp), "w")
 
     test.write_test_keyval({'kvm-userspace-ver':
                             commands.getoutput(ver_cmd).strip()})
@@ -285,9 +512,17 @@ def start_test(server, server_ctl, host, clients, resultsdir, l=60,
                                                      guest_ver_cmd).strip())
     fd.write('### kvm_version : %s\n' % os.uname()[2])
     fd.write('### session-length : %s\n' % l)
-
-    record_list = ['size', 'sessions', 'throughput', 'trans.rate', 'CPU',
-                   'thr_per_CPU', 'rx_pkts', 'tx_pkts', 'rx_byts', 'tx_byts',
+    if len(shards) > 1:
+        test.write_test_keyval({'shards': len(shards)})
+        fd.write('### shards : %s\n' % len(shards))
+
+    record_list = ['size', 'sessions', 'throughput', 'trans.rate', 'CI95',
+                   'stdev', 'iterations', 'lat_min', 'lat_mean', 'lat_p50',
+                   'lat_p90', 'lat_p99', 'lat_p50_approx', 'lat_p90_approx',
+                   'lat_p99_approx', 'lat_max', 'lat_stdev', 'CPU',
+                   'thr_per_CPU', 'vcpu_sec', 'vhost_sec', 'main_sec',
+                   'iothr_sec', 'thr_per_vcpu', 'thr_per_vhost', 'rx_pkts',
+                   'tx_pkts', 'rx_byts', 'tx_byts',
                    're_pkts', 'irq_inj', 'io_exit', 'rpkt_per_irq', 'tpkt_per_exit']
     for i in range(int(params.get("queues", 0))):
         record_list.append('rx_intr_%s' % i)
@@ -295,8 +530,11 @@ def start_test(server, server_ctl, host, clients, resultsdir, l=60,
     for i in range(int(params.get("queues", 0))):
         record_list.append('tx_intr_%s' % i)
     record_list.append('tx_intr_sum')
+    if len(shards) > 1:
+        record_list.append('shard')
     base = params.get("format_base", "12")
     fbase = params.get("format_fbase", "2")
+    records = []
 
     output = ssh_cmd(host, "mpstat 1 1 |grep CPU")
     mpstat_head = re.findall(r"CPU\s+.*", output)[0].split()
@@ -306,6 +544,16 @@ def start_test(server, server_ctl, host, clients, resultsdir, l=60,
     else:
         mpstat_index = 0
 
+    # percentiles need netperf to end by itself, adaptive runs are stopped
+    latency = (params.get("latency_percentiles", "no") == "yes" and
+               params.get("adaptive_run", "no") != "yes")
+
+    if len(shards) > 1:
+        control = params.get("shard_control_point", "TCP_STREAM 1024 1")
+        control = control.split()
+        check_shard_interference(shards, host, l, control, netserver_port,
+                                 params, fd, test)
+
     for protocol in protocols.split():
         error.context("Testing %s protocol" % protocol, logging.info)
         if protocol in ("TCP_RR", "TCP_CRR"):
@@ -321,59 +569,277 @@ def start_test(server, server_ctl, host, clients, resultsdir, l=60,
                 protocol_log = protocol + " (TX)"
         fd.write("Category:" + protocol_log + "\n")
 
-        record_header = True
-        for i in sizes_test:
-            for j in sessions_test:
-                if protocol in ("TCP_RR", "TCP_CRR"):
-                    nf_args = "-t %s -v 1 -- -r %s,%s" % (protocol, i, i)
-                elif (protocol == "TCP_MAERTS"):
-                    nf_args = "-C -c -t %s -- -m ,%s" % (protocol, i)
-                else:
-                    nf_args = "-C -c -t %s -- -m %s" % (protocol, i)
-
-                ret = launch_client(j, server, server_ctl, host, clients, l,
-                                    nf_args, netserver_port, params, server_cyg)
-
-                thu = float(ret['thu'])
+        last_keys = None
+        matrix = [(i, j) for i in sizes_test for j in sessions_test]
+        points = [(j, perf_report.get_nf_args(protocol, i, latency))
+                  for i, j in matrix]
+        results = run_points(shards, host, l, points, netserver_port, params)
+        for index, ((i, j), ret) in enumerate(zip(matrix, results)):
+            thu = float(ret['thu'])
+            if 'cpu' in ret:
+                cpu = ret['cpu']
+            elif 'mpstat' in ret:
                 cpu = 100 - float(ret['mpstat'].split()[mpstat_index])
-                normal = thu / cpu
-                if ret.get('rx_pkts') and ret.get('irq_inj'):
-                    ret['rpkt_per_irq'] = float(
-                        ret['rx_pkts']) / float(ret['irq_inj'])
-                if ret.get('tx_pkts') and ret.get('io_exit'):
-                    ret['tpkt_per_exit'] = float(
-                        ret['tx_pkts']) / float(ret['io_exit'])
-                ret['size'] = int(i)
-                ret['sessions'] = int(j)
-                if protocol in ("TCP_RR", "TCP_CRR"):
-                    ret['trans.rate'] = thu
-                else:
-                    ret['throughput'] = thu
-                ret['CPU'] = cpu
-                ret['thr_per_CPU'] = normal
-                row, key_list = netperf_record(ret, record_list,
-                                               header=record_header,
-                                               base=base,
-                                               fbase=fbase)
-                if record_header:
-                    record_header = False
-                    category = row.split('\n')[0]
-
-                test.write_test_keyval({'category': category})
-                prefix = '%s--%s--%s' % (protocol, i, j)
-                for key in key_list:
+            else:
+                cpu = None
+            if cpu is None:
+                # the host cpu of the shards running at the same time is
+                # measured once, by the point of shard 0
+                normal = cpu = "-"
+            else:
+                concurrent = results[index:index + len(shards)]
+                normal = sum([float(_['thu']) for _ in concurrent]) / cpu
+            if ret.get('rx_pkts') and ret.get('irq_inj'):
+                ret['rpkt_per_irq'] = float(
+                    ret['rx_pkts']) / float(ret['irq_inj'])
+            if ret.get('tx_pkts') and ret.get('io_exit'):
+                ret['tpkt_per_exit'] = float(
+                    ret['tx_pkts']) / float(ret['io_exit'])
+            ret['size'] = int(i)
+            ret['sessions'] = int(j)
+            if protocol in ("TCP_RR", "TCP_CRR"):
+                ret['trans.rate'] = thu
+            else:
+                ret['throughput'] = thu
+            ret['CPU'] = cpu
+            ret['thr_per_CPU'] = normal
+            # throughput per fully busy host CPU of the vcpu/vhost threads
+            if ret.get('vcpu_sec'):
+                ret['thr_per_vcpu'] = thu * ret['cpu_window'] / ret['vcpu_sec']
+            if ret.get('vhost_sec'):
+                ret['thr_per_vhost'] = (thu * ret['cpu_window'] /
+                                        ret['vhost_sec'])
+            # the percentile columns differ between one and more sessions
+            record_header = [_ for _ in record_list if _ in ret] != last_keys
+            row, key_list = netperf_record(ret, record_list,
+                                           header=record_header,
+                                           base=base,
+                                           fbase=fbase)
+            last_keys = key_list
+            if record_header:
+                category = row.split('\n')[0]
+
+            test.write_test_keyval({'category': category})
+            prefix = '%s--%s--%s' % (protocol, i, j)
+            for key in key_list:
+                if ret[key] != "-":
                     test.write_perf_keyval(
                         {'%s--%s' % (prefix, key): ret[key]})
 
-                logging.info(row)
-                fd.write(row + "\n")
+            records.append((protocol, i, j, ret))
+            logging.info(row)
+            fd.write(row + "\n")
+
+            fd.flush()
 
-                fd.flush()
+            if series_fd and ret.get('thu_series'):
+                series = " ".join(["%.2f" % v for v in ret['thu_series']])
+                series_fd.write("%s|%s|%s|%s\n" % (protocol, i, j, series))
+                series_fd.flush()
 
-                logging.debug("Remove temporary files")
-                commands.getoutput("rm -f /tmp/netperf.%s.nf" % ret['pid'])
-                logging.info("Netperf thread completed successfully")
+            if counters_fd and ret.get('counter_series'):
+                for key in sorted(ret['counter_series'].keys()):
+                    series = ret['counter_series'][key]
+                    series = " ".join([str(v) for v in series])
+                    counters_fd.write("%s|%s|%s|%s|%s\n" %
+                                      (protocol, i, j, key, series))
+                counters_fd.flush()
+
+            logging.debug("Remove temporary files")
+            commands.getoutput("rm -f %s" % ret['fname'])
+            logging.info("Netperf thread completed successfully")
     fd.close()
+    for series_file in (series_fd, counters_fd):
+        if series_file:
+            series_file.close()
+    return records
+
+
+def run_points(shards, host, l, points, port, params):
+    """
+    Run netperf matrix points, spread round robin over the shards.
+
+    Every shard runs its points one after another while the shards run in
+    parallel. The results are returned in the order of the points. The host
+    cpu is only measured by shard 0, for all the shards.
+
+    :param shards: list of dicts with server, server_ctl, clients, server_cyg
+                   and server_vm
+    :param host: localhost ip
+    :param l: test duration
+    :param points: list of (sessions, nf_args)
+    :param port: netserver listen port
+    :param params: Dictionary with the test parameters.
+    """
+    def run_shard(index, shard, shard_points):
+        results = []
+        for sessions, nf_args in shard_points:
+            results.append(launch_client(sessions, shard["server"],
+                                         shard["server_ctl"], host,
+                                         shard["clients"], l, nf_args, port,
+                                         params, shard["server_cyg"],
+                                         shard.get("server_vm"),
+                                         shard=index, host_cpu=not index))
+        return results
+
+    if len(shards) == 1:
+        return run_shard(0, shards[0], points)
+
+    targets = []
+    for index, shard in enumerate(shards):
+        targets.append((run_shard, (index, shard,
+                                    points[index::len(shards)])))
+    shard_results = utils_misc.parallel(targets)
+    results = []
+    for index in range(len(points)):
+        ret = shard_results[index % len(shards)][index / len(shards)]
+        ret['shard'] = index % len(shards)
+        results.append(ret)
+    return results
+
+
+def check_shard_interference(shards, host, l, control, port, params, fd,
+                             test):
+    """
+    Run a control point on every shard alone and then on all shards at
+    once, and flag the shards whose result drops when they run together.
+
+    :param shards: list of dicts with server, server_ctl, clients, server_cyg
+                   and server_vm
+    :param host: localhost ip
+    :param l: test duration
+    :param control: control point as [protocol, size, sessions]
+    :param port: netserver listen port
+    :param params: Dictionary with the test parameters.
+    :param fd: opened result file
+    :param test: QEMU test object.
+    """
+    protocol, size, sessions = control
+    point = (sessions, perf_report.get_nf_args(protocol, size))
+    threshold = float(params.get("shard_interference_threshold", 0.9))
+
+    error.context("Run control point %s on each shard alone" % control,
+                  logging.info)
+    isolated = []
+    for shard in shards:
+        isolated.append(float(run_points([shard], host, l, [point], port,
+                                         params)[0]['thu']))
+
+    error.context("Run control point %s on all shards" % control,
+                  logging.info)
+    concurrent = run_points(shards, host, l, [point] * len(shards), port,
+                            params)
+
+    for index, ret in enumerate(concurrent):
+        ratio = float(ret['thu']) / isolated[index]
+        interference = ratio < threshold
+        msg = ("shard-%s control %s : isolated %.2f concurrent %.2f "
+               "ratio %.2f" % (index, "--".join(control), isolated[index],
+                               float(ret['thu']), ratio))
+        if interference:
+            msg += " (cross-shard interference)"
+            logging.warn(msg)
+        else:
+            logging.info(msg)
+        fd.write("### %s\n" % msg)
+        test.write_perf_keyval({'shard-%s--control-ratio' % index: ratio})
+        test.write_test_keyval({'shard-%s-interference' % index:
+                                interference and "yes" or "no"})
+    fd.flush()
+
+
+def get_cpu_jiffies(session):
+    """
+    Get the (total, idle) cpu jiffies of all cpus from /proc/stat
+
+    :param session: a remote shell session or tag for localhost
+    """
+    values = [int(_) for _ in ssh_cmd(session,
+                                      "head -1 /proc/stat").split()[1:9]]
+    return sum(values), values[3]
+
+
+def wait_for_confidence(collector, target, min_time, max_time, step=1):
+    """
+    Keep sampling the interim results until the 95% confidence interval of
+    the per second aggregated result is within target percent of its mean,
+    or max_time is reached.
+
+    :param collector: InterimCollector with an open measurement window
+    :param target: wanted confidence interval half width, percent of mean
+    :param min_time: minimum measurement time in seconds
+    :param max_time: maximum measurement time in seconds
+    :param step: seconds between two checks
+    """
+    start = time.time()
+    while True:
+        time.sleep(step)
+        elapsed = time.time() - start
+        samples = collector.series()[:-1]
+        avg = perf_stats.mean(samples)
+        if elapsed >= min_time and avg:
+            ci = perf_stats.confidence_interval(samples)
+            if ci / avg * 100 <= target:
+                logging.debug("CI95 %.2f within %s%% of %.2f after %ds",
+                              ci, target, avg, elapsed)
+                return True
+        if elapsed >= max_time:
+            logging.warn("CI95 target %s%% not met in %ss", target, max_time)
+            return False
+
+
+def start_counter_sampler(session, options, outfile):
+    """
+    Start counter_sampler.py in background and return its pid
+
+    :param session: a remote shell session or tag for localhost
+    :param options: counter_sampler.py options
+    :param outfile: file the samples are written to
+    """
+    cmd = "nohup python /tmp/counter_sampler.py %s > %s 2>&1 & echo $!" % (
+        options, outfile)
+    return ssh_cmd(session, cmd).split()[-1]
+
+
+def stop_counter_sampler(session, outfile, pid):
+    """
+    Stop a counter sampler and return its samples as (time, counters) list
+
+    :param session: a remote shell session or tag for localhost
+    :param outfile: file the samples are written to
+    :param pid: pid of the sampler
+    """
+    ssh_cmd(session, "kill %s" % pid, ignore_status=True)
+    output = ssh_cmd(session, "cat %s; rm -f %s" % (outfile, outfile))
+    samples = []
+    for line in output.splitlines():
+        fields = line.split()
+        if not fields or not re.match(r"^[\d.]+$", fields[0]):
+            continue
+        counters = {}
+        for field in fields[1:]:
+            key, value = field.split("=")
+            counters[key] = int(value)
+        samples.append((float(fields[0]), counters))
+    return samples
+
+
+def counter_series(samplers_samples):
+    """
+    Align the samples of several samplers by their index and return the
+    counter increase of every interval.
+
+    :param samplers_samples: list of the samples of every sampler
+    :return: dict of counter name to list of per interval deltas
+    """
+    length = min([len(_) for _ in samplers_samples])
+    series = {}
+    for samples in samplers_samples:
+        for index in range(1, length):
+            for key, value in samples[index][1].items():
+                delta = value - samples[index - 1][1].get(key, value)
+                series.setdefault(key, []).append(delta)
+    return series
 
 
 def ssh_cmd(session, cmd, timeout=120, ignore_status=False):
@@ -394,7 +860,8 @@ def ssh_cmd(session, cmd, timeout=120, ignore_status=False):
 
 @error.context_aware
 def launch_client(sessions, server, server_ctl, host, clients, l, nf_args,
-                  port, params, server_cyg):
+                  port, params, server_cyg, server_vm=None, shard=0,
+                  host_cpu=True):
     """ Launch netperf clients """
 
     netperf_version = params.get("netperf_version", "2.6.0")
@@ -464,10 +931,29 @@ def launch_client(sessions, server, server_ctl, host, clients, l, nf_args,
             sum = 0
         return intr
 
-    def get_state():
+    def get_ifname():
         for i in ssh_cmd(server_ctl, "ifconfig").split("\n\n"):
             if server in i:
-                ifname = re.findall(r"(\w+\d+)[:\s]", i)[0]
+                return re.findall(r"(\w+\d+)[:\s]", i)[0]
+
+    def start_samplers():
+        """
+        Start the counter samplers in the server guest and on the host.
+        """
+        interval = params.get("counter_interval", "1")
+        guest_opts = "-i %s -n %s -q virtio.-input,virtio.-output -t" % (
+            interval, get_ifname())
+        host_opts = "-i %s -k" % interval
+        samplers = []
+        for session, opts, tag in ((server_ctl, guest_opts, "guest"),
+                                   (host, host_opts, "host")):
+            outfile = "/tmp/counters.%s.%s.%s" % (pid, server, tag)
+            samplers.append((session, outfile,
+                             start_counter_sampler(session, opts, outfile)))
+        return samplers
+
+    def get_state():
+        ifname = get_ifname()
 
         path = "find /sys/devices|grep net/%s/statistics" % ifname
         cmd = "%s/rx_packets|xargs cat;%s/tx_packets|xargs cat;" \
@@ -519,13 +1005,15 @@ def launch_client(sessions, server, server_ctl, host, clients, l, nf_args,
 
     def netperf_thread(i, numa_enable, client_s, timeout):
         cmd = ""
-        fname = "/tmp/netperf.%s.nf" % pid
         if numa_enable:
             output = ssh_cmd(client_s, "numactl --hardware")
             n = int(re.findall(r"available: (\d+) nodes", output)[0]) - 1
             cmd += "numactl --cpunodebind=%s --membind=%s " % (n, n)
-        cmd += "/tmp/netperf_agent.py %d %s -D 1 -H %s -l %s %s" % (i,
-                                                                    client_path, server, int(l) * 1.5, nf_args)
+        cmd += "/tmp/netperf_agent.py "
+        if collector:
+            cmd += "--report %s:%s " % (report_ip, collector.port)
+        cmd += "%d %s -D 1 -H %s -l %s %s" % (i, client_path, server,
+                                              netperf_length, nf_args)
         cmd += " >> %s" % fname
         logging.info("Start netperf thread by cmd '%s'" % cmd)
         ssh_cmd(client_s, cmd)
@@ -549,7 +1037,10 @@ def launch_client(sessions, server, server_ctl, host, clients, l, nf_args,
         :param sessions: sessions' number
         """
         fd = open(fname)
-        lines = fd.readlines()
+        # the -k keyvals printed at the end of RR latency runs are no
+        # interim results
+        lines = [_ for _ in fd.readlines()
+                 if not re.match(r"^[A-Z_0-9]+=", _)]
         fd.close()
 
         for i in range(1, len(lines) + 1):
@@ -571,10 +1062,33 @@ def launch_client(sessions, server, server_ctl, host, clients, l, nf_args,
 
     error.context("Start netperf client threads", logging.info)
     pid = str(os.getpid())
-    fname = "/tmp/netperf.%s.nf" % pid
+    # the shards run at the same time, each one has its own result file
+    fname = "/tmp/netperf.%s.%s.nf" % (pid, shard)
     ssh_cmd(clients[-1], "rm -f %s" % fname)
     numa_enable = params.get("netperf_with_numa", "yes") == "yes"
     timeout_netperf_start = int(l) * 0.5
+    adaptive = params.get("adaptive_run", "no") == "yes"
+    # the latency selectors are only printed when netperf ends by itself
+    latency = "_LATENCY" in nf_args
+    run_length = l
+    netperf_length = int(l) * 1.5
+    if adaptive:
+        # netperf runs until the confidence target is met or max time
+        run_length = int(params.get("adaptive_max_time", int(l) * 3))
+        netperf_length = int(run_length) * 1.5
+    elif latency:
+        netperf_length = int(l)
+    collector = None
+    if adaptive or params.get("interim_channel", "no") == "yes":
+        # The agent on the client pushes the interim results to the host
+        # over a socket, so there is no need to poll the result file.
+        if clients[0] == "localhost":
+            report_ip = "127.0.0.1"
+        else:
+            report_ip = params.get("interim_report_ip",
+                                   utils_net.get_host_ip_address(params))
+        collector = InterimCollector(int(sessions), report_ip,
+                                     timeout=timeout_netperf_start)
     client_thread = threading.Thread(target=netperf_thread,
                                      kwargs={"i": int(sessions),
                                              "numa_enable": numa_enable,
@@ -584,18 +1098,67 @@ def launch_client(sessions, server, server_ctl, host, clients, l, nf_args,
 
     ret = {}
     ret['pid'] = pid
+    ret['fname'] = fname
 
-    if utils_misc.wait_for(all_clients_up, timeout_netperf_start, 0.0, 0.2,
-                           "Wait until all netperf clients start to work"):
+    if collector:
+        clients_up = collector.wait_started(timeout_netperf_start)
+    else:
+        clients_up = utils_misc.wait_for(all_clients_up,
+                                         timeout_netperf_start, 0.0, 0.2,
+                                         "Wait until all netperf clients "
+                                         "start to work")
+    if clients_up:
         logging.debug("All netperf clients start to work.")
     else:
+        if collector:
+            collector.close()
         raise error.TestNAError("Error, not all netperf clients at work")
 
     # real & effective test starts
-    if get_status_flag:
+    sampling = params.get("counter_sampling", "no") == "yes"
+    if sampling:
+        samplers = start_samplers()
+    elif get_status_flag:
         start_state = get_state()
-    ret['mpstat'] = ssh_cmd(host, "mpstat 1 %d |tail -n 1" % (l - 1))
-    finished_result = ssh_cmd(clients[-1], "cat %s" % fname)
+    if collector:
+        collector.start_window()
+    if server_vm and params.get("thread_cpu", "no") == "yes":
+        cpu_sampler = thread_cpu.ThreadCpu(server_vm)
+        cpu_sampler.start()
+    else:
+        cpu_sampler = None
+    if adaptive:
+        cpu_start = get_cpu_jiffies(host)
+        wait_for_confidence(collector,
+                            float(params.get("adaptive_ci_target", 5)),
+                            int(params.get("adaptive_min_time", 10)),
+                            run_length)
+        cpu_end = get_cpu_jiffies(host)
+        total = cpu_end[0] - cpu_start[0]
+        if host_cpu:
+            ret['cpu'] = 100 - 100.0 * (cpu_end[1] - cpu_start[1]) / total
+    elif host_cpu:
+        ret['mpstat'] = ssh_cmd(host, "mpstat 1 %d |tail -n 1" % (l - 1))
+    else:
+        time.sleep(l - 1)
+    if collector:
+        collector.stop_window()
+    else:
+        finished_result = ssh_cmd(clients[-1], "cat %s" % fname)
+    if cpu_sampler:
+        seconds, ret['cpu_window'] = cpu_sampler.stop()
+        ret['vcpu_sec'] = seconds['vcpu']
+        ret['vhost_sec'] = seconds['vhost']
+        ret['main_sec'] = seconds['main']
+        ret['iothr_sec'] = seconds['iothread']
+    if sampling:
+        samples = [stop_counter_sampler(*_) for _ in samplers]
+        ret['counter_series'] = counter_series(samples)
+        for key, deltas in ret['counter_series'].items():
+            ret[key] = sum(deltas)
+
+    if latency:
+        client_thread.join(int(l))
 
     # stop netperf clients
     kill_cmd = "killall netperf"
@@ -604,7 +1167,7 @@ def launch_client(sessions, server, server_ctl, host, clients, l, nf_args,
     ssh_cmd(clients[-1], kill_cmd, ignore_status=True)
 
     # real & effective test ends
-    if get_status_flag:
+    if get_status_flag and not sampling:
         end_state = get_state()
         if len(start_state) != len(end_state):
             msg = "Initial state not match end state:\n"
@@ -619,6 +1182,19 @@ def launch_client(sessions, server, server_ctl, host, clients, l, nf_args,
     client_thread.join()
 
     error.context("Testing Results Treatment and Report", logging.info)
+    if latency:
+        output = ssh_cmd(clients[-1], "cat %s" % fname)
+        ret.update(perf_report.parse_latency(output, int(sessions)))
+    if collector:
+        collector.close()
+        ret['thu'] = collector.throughput()
+        ret['thu_series'] = collector.series()
+        # the last second may miss the reports of some sessions
+        samples = ret['thu_series'][:-1] or ret['thu_series']
+        ret['CI95'] = perf_stats.confidence_interval(samples)
+        ret['stdev'] = perf_stats.stdev(samples)
+        ret['iterations'] = len(samples)
+        return ret
     f = open(fname, "w")
     f.write(finished_result)
     f.close()
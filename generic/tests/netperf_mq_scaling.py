@@ -0,0 +1,71 @@
+import logging
+from autotest.client.shared import error
+from virttest import env_process
+from generic.tests import netperf
+from provider import perf_report, perf_stats
+
+
+@error.context_aware
+def run(test, params, env):
+    """
+    Multi queue virtio-net scaling sweep with netperf.
+
+    1) For every queue count in mq_sweep_queues boot the guest with
+       queues=N and enable the N queues by ethtool -L
+    2) Stop irqbalance in guest and bind the input/output irq of queue N
+       to vcpu N % smp
+    3) Run the same netperf point with the netperf test
+    4) Report throughput, speedup and efficiency against linear scaling
+       and the per queue interrupt balance (Jain's index) per queue count
+
+    :param test: QEMU test object.
+    :param params: Dictionary with the test parameters.
+    :param env: Dictionary with test environment.
+    """
+    vm_name = params["main_vm"]
+    protocol, size, sessions = params.get("mq_sweep_point",
+                                          "TCP_STREAM 1024 4").split()
+
+    results = []
+    for queues in params.get("mq_sweep_queues", "1 2 4").split():
+        error.context("Boot guest with %s queues" % queues, logging.info)
+        params_queues = params.copy()
+        params_queues["queues"] = queues
+        params_queues["protocols"] = protocol
+        if protocol in ("TCP_RR", "TCP_CRR"):
+            params_queues["sizes_rr"] = size
+            params_queues["sessions_rr"] = sessions
+        else:
+            params_queues["sizes"] = size
+            params_queues["sessions"] = sessions
+        params_queues["start_vm"] = "yes"
+        # netperf spreads the irq after its guest config and reboot
+        params_queues["spread_queues_irq"] = "yes"
+        vm = env.get_vm(vm_name)
+        if vm:
+            vm.destroy(gracefully=False)
+        env_process.preprocess_vm(test, params_queues, env, vm_name)
+        vm = env.get_vm(vm_name)
+        vm.verify_alive()
+
+        error.context("Run netperf with %s queues" % queues, logging.info)
+        records = netperf.run(test, params_queues, env)
+        results.append((int(queues), records[0][3]))
+
+    error.context("Report the multi queue scaling", logging.info)
+    base_queues, base = results[0]
+    base_thu = float(base['thu'])
+    keys = ["queues", "throughput", "speedup", "efficiency", "rx_irq_jain",
+            "tx_irq_jain"]
+    table = perf_report.ResultTable(test, "netperf-mq-scaling", keys)
+    for queues, ret in results:
+        row = {"queues": queues, "throughput": float(ret['thu'])}
+        row["speedup"] = row["throughput"] / base_thu
+        # linear scaling from the first queue count of the sweep
+        row["efficiency"] = row["speedup"] * base_queues / queues
+        for direction in ("rx", "tx"):
+            counts = [ret.get("%s_intr_%s" % (direction, i), 0)
+                      for i in range(queues)]
+            row["%s_irq_jain" % direction] = perf_stats.jain_index(counts)
+        table.add(row, "queues-%s" % queues)
+    table.log("Multi queue scaling")
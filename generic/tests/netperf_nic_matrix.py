@@ -0,0 +1,93 @@
+import logging
+import os
+from autotest.client.shared import error
+from virttest import env_process
+from generic.tests import netperf
+from provider import perf_report
+
+
+def host_cpus(ret):
+    """
+    Host cpus busy for the guest during a point.
+
+    The qemu thread roles are used when thread_cpu is on, the whole host
+    cpu otherwise.
+    """
+    if ret.get('cpu_window'):
+        roles = ('vcpu_sec', 'vhost_sec', 'main_sec', 'iothr_sec')
+        seconds = sum([ret.get(_, 0) for _ in roles])
+        return seconds / ret['cpu_window']
+    return float(ret['CPU']) * ret['host_ncpu'] / 100
+
+
+@error.context_aware
+def run(test, params, env):
+    """
+    Compare nic models and vhost with the same reduced netperf matrix.
+
+    1) For every "model:vhost" of nic_matrix boot the guest with
+       nic_model = model and vhost=on/off
+    2) Run the stream and the RR point with the netperf test
+    3) Report throughput, TCP_RR rate and host cpus per Gbit/s and per
+       1000 trans/s of every variant, normalized to the first variant
+       (the vhost virtio baseline)
+
+    :param test: QEMU test object.
+    :param params: Dictionary with the test parameters.
+    :param env: Dictionary with test environment.
+    """
+    vm_name = params["main_vm"]
+    stream_protocol, stream_size, stream_sessions = params.get(
+        "nic_matrix_stream", "TCP_STREAM 16384 1").split()
+    rr_protocol, rr_size, rr_sessions = params.get(
+        "nic_matrix_rr", "TCP_RR 1 1").split()
+    host_ncpu = int(os.sysconf("SC_NPROCESSORS_ONLN"))
+
+    results = []
+    for variant in params.get("nic_matrix",
+                              "virtio:on virtio:off e1000:off").split():
+        model, vhost = variant.split(":")
+        error.context("Boot guest with %s nic and vhost=%s" % (model, vhost),
+                      logging.info)
+        params_variant = params.copy()
+        params_variant["nic_model"] = model
+        params_variant["nic_model_nic1"] = model
+        params_variant["vhost"] = "vhost=%s" % vhost
+        params_variant["protocols"] = "%s %s" % (stream_protocol, rr_protocol)
+        params_variant["sizes"] = stream_size
+        params_variant["sessions"] = stream_sessions
+        params_variant["sizes_rr"] = rr_size
+        params_variant["sessions_rr"] = rr_sessions
+        params_variant["thread_cpu"] = "yes"
+        params_variant["start_vm"] = "yes"
+        vm = env.get_vm(vm_name)
+        if vm:
+            vm.destroy(gracefully=False)
+        env_process.preprocess_vm(test, params_variant, env, vm_name)
+        env.get_vm(vm_name).verify_alive()
+
+        error.context("Run netperf with %s" % variant, logging.info)
+        records = netperf.run(test, params_variant, env)
+        stream, rr = records[0][3], records[1][3]
+        stream['host_ncpu'] = rr['host_ncpu'] = host_ncpu
+        row = {"variant": variant, "throughput": float(stream['thu']),
+               "trans_rate": float(rr['thu'])}
+        row["cpu_per_gbit"] = (host_cpus(stream) * 1000 /
+                               max(row["throughput"], 1))
+        row["cpu_per_ktrans"] = (host_cpus(rr) * 1000 /
+                                 max(row["trans_rate"], 1))
+        results.append(row)
+
+    error.context("Report the nic model comparison", logging.info)
+    base = results[0]
+    metrics = ["throughput", "trans_rate", "cpu_per_gbit", "cpu_per_ktrans"]
+    keys = ["variant"]
+    for metric in metrics:
+        keys += [metric, "%s_norm" % metric]
+    table = perf_report.ResultTable(test, "netperf-nic-matrix", keys,
+                                    base="14", fbase="3")
+    for row in results:
+        for metric in metrics:
+            row["%s_norm" % metric] = row[metric] / (base[metric] or 1)
+        table.add(row, row["variant"].replace(":", "-vhost_"))
+    table.log("Nic model comparison, normalized to %s" % base["variant"])
@@ -1,7 +1,49 @@
 import logging
+import math
+import os
+import re
 from autotest.client.shared import error
 from autotest.client import utils
 from virttest import utils_test, utils_net
+from provider import perf_stats, perf_report
+
+RTT_RE = re.compile(r"time=([\d.]+) ms")
+
+
+def parse_rtt_file(path):
+    """
+    Parse the RTT of every reply in a ping output file.
+
+    The file is read line by line, so huge counts do not need their whole
+    output in memory.
+
+    :param path: file with the output of ping
+    :return: list of RTTs in microseconds
+    """
+    rtts = []
+    search = RTT_RE.search
+    ping_file = open(path)
+    try:
+        for line in ping_file:
+            match = search(line)
+            if match:
+                rtts.append(float(match.group(1)) * 1000)
+    finally:
+        ping_file.close()
+    return rtts
+
+
+def rtt_histogram(rtts):
+    """
+    Count the RTTs in power of two microsecond buckets.
+
+    :return: dict of the bucket lower bound in microseconds to count
+    """
+    histogram = {}
+    for rtt in rtts:
+        bucket = 2 ** int(math.log(max(rtt, 1), 2))
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+    return histogram
 
 
 @error.context_aware
@@ -17,6 +59,8 @@ def run(test, params, env):
     3) Ping test from guest side, packet size is from 0 to 65507
        (win guest is up to 65500) (Optional)
 
+    With ping_latency = yes the steps above record a RTT histogram instead.
+
     :param test: QEMU test object.
     :param params: Dictionary with the test parameters.
     :param env: Dictionary with test environment.
@@ -55,6 +99,13 @@ def run(test, params, env):
             # Fallback to a hardcode host, eg:
             ext_host = default_host
 
+    if params.get("ping_latency", "no") == "yes":
+        try:
+            ping_latency(test, params, env, vm, session)
+        finally:
+            session.close()
+        return
+
     counts = params.get("ping_counts", 100)
     flood_minutes = float(params.get("flood_minutes", 10))
 
@@ -128,3 +179,69 @@ def run(test, params, env):
                     raise error.TestFail(("Ping external host failed,"
                                           " status: %s, output: %s" %
                                           (status, output)))
+
+
+def ping_latency(test, params, env, vm, session):
+    """
+    Record the RTT distribution of host to guest and guest to guest pings
+
+    :param vm: the vm pinged from host, and pinging the peer vm
+    :param session: session of vm
+    """
+    count = int(params.get("ping_latency_count", 100000))
+    interval = params.get("ping_latency_interval", "0.01")
+    size = params.get("ping_latency_size", "56")
+    ping_opts = "-c %s -s %s" % (count, size)
+    if params.get("ping_latency_adaptive", "no") == "yes":
+        ping_opts += " -A"
+    else:
+        ping_opts += " -i %s" % interval
+    timeout = count * float(interval) * 2 + 60
+
+    paths = []
+    for i, nic in enumerate(vm.virtnet):
+        ip = vm.get_address(i)
+        if not ip:
+            continue
+        nic_name = nic.get("nic_name")
+        nic_opts = ping_opts
+        if ip.upper().startswith("FE80"):
+            # link local addresses need the interface of the neighbour
+            nic_opts += " -I %s" % utils_net.get_neigh_attch_interface(ip)
+        error.context("Ping nic %s of %s from host %s times" %
+                      (nic_name, vm.name, count), logging.info)
+        path = os.path.join(test.debugdir, "ping-host-%s" % nic_name)
+        utils.system("ping %s %s > %s" % (nic_opts, ip, path),
+                     timeout=timeout, ignore_status=True)
+        paths.append(("host-%s" % nic_name, path))
+
+    peer = params.get("ping_latency_peer")
+    if peer and params.get("os_type") == "linux":
+        peer_vm = env.get_vm(peer)
+        peer_vm.verify_alive()
+        error.context("Ping %s from %s %s times" % (peer, vm.name, count),
+                      logging.info)
+        guest_path = "/tmp/ping-%s" % peer
+        session.cmd("ping %s %s > %s" % (ping_opts, peer_vm.get_address(),
+                                         guest_path),
+                    timeout=timeout, ignore_all_errors=True)
+        path = os.path.join(test.debugdir, "ping-guest-%s" % peer)
+        vm.copy_files_from(guest_path, path)
+        paths.append(("guest-%s" % peer, path))
+
+    table = perf_report.ResultTable(test, "ping-latency",
+                                    ["path", "replies", "p50", "p99", "p999",
+                                     "max"], base="16", fbase="1")
+    for name, path in paths:
+        rtts = parse_rtt_file(path)
+        if not rtts:
+            raise error.TestFail("No ping reply on path %s" % name)
+        p50, p99, p999 = perf_stats.percentiles(rtts, [50, 99, 99.9])
+        row = {"path": name, "replies": len(rtts), "p50": p50, "p99": p99,
+               "p999": p999, "max": max(rtts)}
+        table.add(row, name)
+        keyvals = {}
+        for bucket, bucket_count in rtt_histogram(rtts).items():
+            keyvals["%s--hist_us_%s" % (name, bucket)] = bucket_count
+        test.write_perf_keyval(keyvals)
+    table.log("Ping RTT (us)")
@@ -4,6 +4,7 @@ import os
 from virttest import utils_misc, aexpect, utils_net, openvswitch, ovs_utils
 from virttest import versionable_class, data_dir
 from autotest.client.shared import error
+from provider import perf_stats, perf_report
 
 
 def allow_iperf_firewall(machine):
@@ -178,9 +179,135 @@ def run(test, params, env):
             logging.info("UDP Bandwidth from vm->vm: %s", speeds[2])
 
         def clean(self, test, params, env):
-            self.host.cmd("killall -9 iperf")
+            self.host.cmd("killall -9 iperf || true")
             super(test_iperf, self).clean(test, params, env)
 
+    class test_iperf_mesh(test_iperf):
+
+        """
+        Start iperf between VM pairs at the same moment and report the
+        per flow and aggregate throughput and their fairness, for growing
+        numbers of bridge ports.
+        """
+
+        def get_pairs(self, count, pairs):
+            """
+            Return (client, server) indexes of the first count vms
+
+            :param pairs: "all" for every ordered pair, "permutation" for
+                          vm N to vm N+1, or a list of client-server indexes
+            """
+            if pairs == "all":
+                return [(c, s) for c in range(count) for s in range(count)
+                        if c != s]
+            if pairs == "permutation":
+                return [(c, (c + 1) % count) for c in range(count)]
+            return [tuple(int(_) for _ in pair.split("-"))
+                    for pair in pairs.split()
+                    if max(int(_) for _ in pair.split("-")) < count]
+
+        def run_mesh(self, pairs, iperf_time, add_params, start_delay):
+            """
+            Run all pairs concurrently from a common start time
+
+            :param start_delay: seconds from now to the start of all flows,
+                                enough to send the commands of every flow
+            :return: list of (client, server, Mbit/s) of every flow
+            """
+            out_file = "/tmp/iperf_mesh.%s"
+            flows = {}
+            for client, server in pairs:
+                flows.setdefault(client, []).append(server)
+            for client in flows:
+                self.mvms[client].cmd("rm -f %s" % (out_file % "*"))
+
+            # every client sleeps until the start time of host, the commands
+            # are sent one after another, iperf does not start with them
+            start_time = time.time() + start_delay
+            for client in flows:
+                for server in flows[client]:
+                    ip = self.mvms[server].virtnet[1].ip["ipv4"][0]
+                    self.mvms[client].cmd_in_src(
+                        "(sleep %.3f; %s -c %s -t %s -y C %s) > %s 2>&1 &" %
+                        (max(start_time - time.time(), 0), self.iperf_b_path,
+                         ip, iperf_time, add_params, out_file % server))
+            if time.time() > start_time:
+                raise error.TestError("Sending the iperf commands took more "
+                                      "than %ss, the flows did not start "
+                                      "together" % start_delay)
+            time.sleep(start_time - time.time() + iperf_time)
+
+            def get_outputs():
+                outputs = {}
+                for client in flows:
+                    for server in flows[client]:
+                        output = self.mvms[client].cmd(
+                            "cat %s" % (out_file % server))
+                        # csv: time,src,sport,dst,dport,id,interval,bytes,bps
+                        lines = [_ for _ in output.splitlines()
+                                 if _.count(",") >= 8]
+                        if not lines:
+                            return None
+                        outputs[(client, server)] = lines[-1]
+                return outputs
+
+            outputs = utils_misc.wait_for(get_outputs, 60, 0, 2,
+                                          "Wait iperf clients finish")
+            if not outputs:
+                raise error.TestError("Fail to get the output of all iperf "
+                                      "clients")
+            return [(c, s, float(outputs[(c, s)].split(",")[8]) / 1000000)
+                    for c, s in pairs]
+
+        def test(self, test, params, env):
+            iperf_src_path = os.path.join(data_dir.get_deps_dir(), "iperf")
+            self.iperf_b_path = os.path.join("iperf-2.0.4", "src", "iperf")
+
+            error.context("Install iperf to vms machine.")
+            utils_misc.ForAllP(
+                self.mvms).compile_autotools_app_tar(iperf_src_path,
+                                                     "iperf-2.0.4.tar.gz")
+            utils_misc.ForAllP(self.mvms).cmd("iptables -F")
+            utils_misc.ForAllP(
+                self.mvms).cmd_in_src("%s -s &> /dev/null &" %
+                                      (self.iperf_b_path))
+
+            iperf_time = int(params.get("iperf_mesh_time", 30))
+            add_params = params.get("iperf_mesh_params", "")
+            start_delay = float(params.get("iperf_mesh_start_delay", 10))
+            table = perf_report.ResultTable(test, "iperf-mesh",
+                                            ["ports", "flows", "aggregate",
+                                             "min_flow", "max_flow", "jain"])
+            for count in params.get("iperf_mesh_ports",
+                                    str(len(self.mvms))).split():
+                count = int(count)
+                pairs = self.get_pairs(count, params.get("iperf_mesh_pairs",
+                                                         "all"))
+                error.context("Run %s iperf flows between %s vms." %
+                              (len(pairs), count), logging.info)
+                results = self.run_mesh(pairs, iperf_time, add_params,
+                                        start_delay)
+                speeds = [_[2] for _ in results]
+                for client, server, speed in results:
+                    logging.info("Flow %s->%s: %.2f Mbit/s",
+                                 self.vms[client].name,
+                                 self.vms[server].name, speed)
+                    test.write_perf_keyval({"ports-%s--%s-%s" %
+                                            (count, self.vms[client].name,
+                                             self.vms[server].name): speed})
+                row = {"ports": count, "flows": len(pairs),
+                       "aggregate": sum(speeds), "min_flow": min(speeds),
+                       "max_flow": max(speeds),
+                       "jain": perf_stats.jain_index(speeds)}
+                table.add(row, "ports-%s" % count)
+            table.log("iperf mesh throughput (Mbit/s)")
+
+        def clean(self, test, params, env):
+            # the flows ended in time on some guests and the host runs no
+            # iperf in the mesh
+            utils_misc.ForAllP(self.mvms).cmd("killall -9 iperf || true")
+            test_iperf.clean(self, test, params, env)
+
     class test_vlan_ping(InfrastructureInit):
 
         def test(self, test, params, env):
@@ -0,0 +1,258 @@
+"""
+Shared netperf and result report helpers for the performance tests
+"""
+import logging
+import os
+import re
+
+from autotest.client.shared import error
+from virttest import utils_netperf, data_dir
+
+# netperf omni output selectors of the RR latency percentiles
+LATENCY_SELECTORS = ["TRANSACTION_RATE", "MIN_LATENCY", "MEAN_LATENCY",
+                     "P50_LATENCY", "P90_LATENCY", "P99_LATENCY",
+                     "MAX_LATENCY", "STDDEV_LATENCY"]
+
+
+def format_result(result, base="12", fbase="5"):
+    """
+    Format the result to a fixed length string.
+
+    :param result: result need to convert
+    :param base: the length of converted string
+    :param fbase: the decimal digit for float
+    """
+    if isinstance(result, str):
+        value = "%" + base + "s"
+    elif isinstance(result, int):
+        value = "%" + base + "d"
+    elif isinstance(result, float):
+        value = "%" + base + "." + fbase + "f"
+    return value % result
+
+
+def get_nf_args(protocol, size, latency=False):
+    """
+    Get the netperf test specific arguments of a matrix point.
+
+    :param protocol: netperf test type
+    :param size: message size, request/response size for RR tests
+    :param latency: ask RR tests for the latency keyvals
+    """
+    if protocol in ("TCP_RR", "TCP_CRR"):
+        if latency:
+            # -j makes netperf keep the latency statistics for the -k
+            # selectors, they are -1 otherwise
+            return "-t %s -v 1 -j -- -r %s,%s -k %s" % (
+                protocol, size, size, ",".join(LATENCY_SELECTORS))
+        return "-t %s -v 1 -- -r %s,%s" % (protocol, size, size)
+    elif (protocol == "TCP_MAERTS"):
+        return "-C -c -t %s -- -m ,%s" % (protocol, size)
+    return "-C -c -t %s -- -m %s" % (protocol, size)
+
+
+def parse_latency(output, sessions):
+    """
+    Aggregate the latency keyvals printed by all netperf sessions.
+
+    Minimum and maximum are exact, the mean is weighted by the transaction
+    rate of every session and the stdev is pooled over the sessions.
+    netperf only reports per session percentiles, so they are exact for one
+    session only. With more sessions the transaction rate weighted average
+    of the session percentiles is returned as lat_pXX_approx instead, it is
+    not a percentile of the merged latencies. Latencies are in microseconds.
+
+    :param output: output of all netperf sessions
+    :param sessions: sessions' number
+    """
+    values = {}
+    for key in LATENCY_SELECTORS:
+        values[key] = [float(_) for _ in
+                       re.findall(r"^%s=(\S+)" % key, output, re.M)]
+    if [len(_) for _ in values.values()] != [sessions] * len(values):
+        logging.warn("Expect latency keyvals of %s sessions, got %s",
+                     sessions, values)
+        return {}
+
+    rates = values["TRANSACTION_RATE"]
+    total = sum(rates)
+    if not total:
+        return {}
+
+    def weighted(key):
+        return sum([r * v for r, v in zip(rates, values[key])]) / total
+
+    mean = weighted("MEAN_LATENCY")
+    variance = sum([r * (s ** 2 + (m - mean) ** 2) for r, s, m in
+                    zip(rates, values["STDDEV_LATENCY"],
+                        values["MEAN_LATENCY"])]) / total
+    latency = {'lat_min': min(values["MIN_LATENCY"]),
+               'lat_mean': mean,
+               'lat_max': max(values["MAX_LATENCY"]),
+               'lat_stdev': variance ** 0.5}
+    suffix = sessions > 1 and "_approx" or ""
+    for pct in ("50", "90", "99"):
+        latency["lat_p%s%s" % (pct, suffix)] = weighted("P%s_LATENCY" % pct)
+    return latency
+
+
+def netperf_pair(params, server_ip, client_ip, server_shell=None,
+                 client_shell=None, **kwargs):
+    """
+    Create a netperf server and client from the netperf_link params.
+
+    :param params: Dictionary with the test parameters
+    :param server_ip: address of the netperf server
+    :param client_ip: address of the netperf client
+    :param server_shell: dictionary of shell_client, shell_port, username
+                         and password of the server, the guest ones of
+                         params by default
+    :param client_shell: the same for the client
+    :param kwargs: extra arguments of both, e.g. compile_option
+    :return: tuple of NetperfServer and NetperfClient
+    """
+    netperf_link = os.path.join(data_dir.get_deps_dir("netperf"),
+                                params.get("netperf_link"))
+    md5sum = params.get("pkg_md5sum")
+    guest_shell = {"shell_client": params.get("shell_client"),
+                   "shell_port": params.get("shell_port"),
+                   "username": params.get("username"),
+                   "password": params.get("password")}
+    server_shell = server_shell or guest_shell
+    client_shell = client_shell or guest_shell
+    server = utils_netperf.NetperfServer(
+        server_ip, params.get("server_path", "/var/tmp/"), md5sum,
+        netperf_link, server_shell["shell_client"],
+        server_shell["shell_port"], username=server_shell["username"],
+        password=server_shell["password"], **kwargs)
+    client = utils_netperf.NetperfClient(
+        client_ip, params.get("client_path", "/var/tmp/"), md5sum,
+        netperf_link, client_shell["shell_client"],
+        client_shell["shell_port"], username=client_shell["username"],
+        password=client_shell["password"], **kwargs)
+    return server, client
+
+
+def netperf_cleanup(server, client):
+    """
+    Stop the netperf server and remove the netperf packages of the pair.
+    """
+    server.stop()
+    client.package.env_cleanup(True)
+    server.package.env_cleanup(True)
+
+
+def netperf_keyvals(client, server_ip, option, selectors):
+    """
+    Run netperf and get the values of the omni output selectors.
+
+    :param client: NetperfClient instance
+    :param server_ip: address of the netperf server
+    :param option: netperf options, the test specific ones after --
+    :param selectors: list of omni output selectors
+    :return: dictionary of selector to float value
+    """
+    if " -- " not in " %s " % option:
+        option += " --"
+    option = "%s -k %s" % (option, ",".join(selectors))
+    output = client.start(server_ip, option)
+    values = {}
+    for key in selectors:
+        value = re.findall(r"^%s=(\S+)" % key, output, re.M)
+        if not value:
+            raise error.TestError("Fail to get %s of '%s', netperf output: "
+                                  "%s" % (key, option, output))
+        values[key] = float(value[0])
+    return values
+
+
+def netperf_throughput(client, server_ip, test_time, protocol="TCP_STREAM",
+                       size=16384):
+    """
+    Run a stream test for test_time seconds and get its throughput.
+    """
+    option = "-l %s %s" % (test_time, get_nf_args(protocol, size))
+    return netperf_keyvals(client, server_ip, option,
+                           ["THROUGHPUT"])["THROUGHPUT"]
+
+
+def netperf_latency(client, server_ip, test_time, protocol="TCP_RR", size=1):
+    """
+    Run a RR test for test_time seconds and get its latency keyvals.
+
+    :return: dictionary of parse_latency
+    """
+    option = "-l %s %s" % (test_time, get_nf_args(protocol, size,
+                                                  latency=True))
+    output = client.start(server_ip, option)
+    latency = parse_latency(output, 1)
+    if not latency:
+        raise error.TestError("Fail to get %s latency, netperf output: %s" %
+                              (protocol, output))
+    return latency
+
+
+class ResultTable(object):
+
+    """
+    Result table of a performance test.
+
+    Every row is written to a file of the results dir as soon as it is added,
+    so the finished rows survive a failure of the test, and to the perf
+    keyvals as <prefix>--<key>.
+    """
+
+    def __init__(self, test, name, keys, base="12", fbase="2"):
+        """
+        :param test: test object
+        :param name: file name of the table in the results dir
+        :param keys: row keys of the table columns
+        :param base: the length of the columns
+        :param fbase: the decimal digit for float
+        """
+        self.test = test
+        self.keys = keys
+        self.base = base
+        self.fbase = fbase
+        self.filename = os.path.join(test.resultsdir, name)
+        self.msg = "|".join([format_result(_, base=base) for _ in keys])
+        self.msg += "\n"
+        self._write(self.msg, "w")
+
+    def _write(self, line, mode):
+        result_file = open(self.filename, mode)
+        try:
+            result_file.write(line)
+        finally:
+            result_file.close()
+
+    def add(self, row, prefix=None, keyval_keys=None):
+        """
+        Add a row to the table.
+
+        :param row: dictionary of key to value, it has all the table keys
+        :param prefix: prefix of the perf keyvals of the row, no keyvals
+                       are written without one
+        :param keyval_keys: keys written as perf keyvals, all the columns
+                            but the first one by default; "-" values are
+                            skipped
+        """
+        line = "|".join([format_result(row[_], base=self.base,
+                                       fbase=self.fbase)
+                         for _ in self.keys]) + "\n"
+        self.msg += line
+        self._write(line, "a")
+        if prefix is None:
+            return
+        if keyval_keys is None:
+            keyval_keys = self.keys[1:]
+        for key in keyval_keys:
+            if row[key] != "-":
+                self.test.write_perf_keyval({"%s--%s" % (prefix, key):
+                                             row[key]})
+
+    def log(self, title):
+        """
+        Log the whole table.
+        """
+        logging.info("%s:\n%s", title, self.msg)
@@ -0,0 +1,111 @@
+"""
+Shared statistics helpers for the performance tests
+"""
+import math
+
+# two sided 95% t-distribution critical values by degrees of freedom
+_T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262,
+         2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101,
+         2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052,
+         2.048, 2.045, 2.042]
+
+
+def mean(values):
+    """
+    Arithmetic mean of the values, 0.0 for an empty list.
+    """
+    if not values:
+        return 0.0
+    return float(sum(values)) / len(values)
+
+
+def stdev(values):
+    """
+    Sample standard deviation of the values, 0.0 for less than two values.
+    """
+    if len(values) < 2:
+        return 0.0
+    avg = mean(values)
+    return math.sqrt(sum([(v - avg) ** 2 for v in values]) /
+                     (len(values) - 1))
+
+
+def t_critical(df):
+    """
+    Two sided 95% critical value of the t-distribution.
+
+    :param df: degrees of freedom, at least 1
+    """
+    if df <= len(_T_95):
+        return _T_95[df - 1]
+    return 1.96
+
+
+def confidence_interval(values):
+    """
+    Half width of the 95% confidence interval of the mean.
+
+    :param values: samples, at least two are needed for a finite width
+    """
+    if len(values) < 2:
+        return float("inf")
+    return t_critical(len(values) - 1) * stdev(values) / math.sqrt(len(values))
+
+
+def paired_t_test(before, after):
+    """
+    Two sided paired t-test at 95% confidence.
+
+    :param before: samples of the baseline
+    :param after: samples of the change, paired by index with before
+    :return: tuple of the mean difference (after - before) and whether it
+             is significant
+    """
+    diffs = [b - a for a, b in zip(before, after)]
+    if len(diffs) < 2:
+        return mean(diffs), False
+    deviation = stdev(diffs)
+    if not deviation:
+        return mean(diffs), mean(diffs) != 0
+    t_value = mean(diffs) / (deviation / math.sqrt(len(diffs)))
+    return mean(diffs), abs(t_value) > t_critical(len(diffs) - 1)
+
+
+def jain_index(values):
+    """
+    Jain's fairness index of the values, 1.0 when all values are equal and
+    1/n when a single one gets everything.
+    """
+    if not values or not sum(values):
+        return 0.0
+    return (float(sum(values)) ** 2 /
+            (len(values) * sum([float(v) ** 2 for v in values])))
+
+
+def percentiles(values, pcts):
+    """
+    Percentiles of the values by linear interpolation between the closest
+    ranks, the values are sorted once for all of them.
+
+    :param values: samples, need not be sorted
+    :param pcts: list of percentiles in [0, 100]
+    :return: list of the percentiles, 0.0 for empty values
+    """
+    if not values:
+        return [0.0] * len(pcts)
+    ordered = sorted(values)
+    results = []
+    for pct in pcts:
+        rank = (len(ordered) - 1) * pct / 100.0
+        low = int(rank)
+        high = min(low + 1, len(ordered) - 1)
+        results.append(ordered[low] +
+                       (ordered[high] - ordered[low]) * (rank - low))
+    return results
+
+
+def percentile(values, pct):
+    """
+    Percentile of the values, see percentiles.
+    """
+    return percentiles(values, [pct])[0]
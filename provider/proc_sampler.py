@@ -0,0 +1,198 @@
+"""
+Sample cpu, memory and process usage from /proc at a fixed interval
+
+The module is used in process on the host and is copied to the guest and
+run there as a small agent:
+
+    python proc_sampler.py <output file> <interval> [label=pid ...]
+
+The agent samples until it gets SIGTERM or SIGINT. Both write the same
+time series, a header line followed by one line per interval:
+
+    # time cpu cpu0 cpu1 ... iowait mem_used <label> ...
+
+cpu and cpuN are the busy percentages of the whole system and of every
+cpu (iowait included, like 100 - %idle of mpstat), iowait the iowait
+percentage of the whole system, mem_used the used memory in kB and <label>
+the percentage of one cpu used by the process.
+"""
+import os
+import signal
+import sys
+import threading
+import time
+
+
+def _read(path):
+    f = open(path)
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def read_cpu_ticks():
+    """
+    Get the busy and total ticks of every cpu line of /proc/stat.
+
+    :return: list of (name, busy, iowait, total), the "cpu" line first
+    """
+    ticks = []
+    for line in _read("/proc/stat").splitlines():
+        if not line.startswith("cpu"):
+            continue
+        fields = line.split()
+        values = [int(_) for _ in fields[1:]]
+        # busy is 100 - %idle of mpstat, guest time is part of user already
+        idle, iowait = values[3], values[4]
+        total = sum(values[:8])
+        ticks.append((fields[0], total - idle, iowait, total))
+    return ticks
+
+
+def read_mem_used():
+    """
+    Get the used memory in kB from /proc/meminfo.
+    """
+    meminfo = {}
+    for line in _read("/proc/meminfo").splitlines():
+        key, value = line.split(":", 1)
+        meminfo[key] = int(value.split()[0])
+    free = meminfo["MemFree"] + meminfo.get("Buffers", 0)
+    free += meminfo.get("Cached", 0)
+    return meminfo["MemTotal"] - free
+
+
+def read_pid_ticks(pid):
+    """
+    Get utime + stime of a process from /proc/<pid>/stat, 0 if it is gone.
+    """
+    try:
+        stat = _read("/proc/%s/stat" % pid)
+    except IOError:
+        return 0
+    # comm may contain spaces, the fields after it are fixed
+    fields = stat[stat.rfind(")") + 2:].split()
+    return int(fields[11]) + int(fields[12])
+
+
+class ProcSampler(threading.Thread):
+
+    """
+    Write the /proc time series to a file from a thread.
+
+    start() begins sampling, stop() writes the last interval, closes the
+    file and waits for the thread.
+    """
+
+    def __init__(self, filename, interval=1.0, pids=None):
+        """
+        :param filename: file to write the time series to
+        :param interval: seconds between two samples
+        :param pids: dictionary of column label to pid of the processes to
+                     sample
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.filename = filename
+        self.interval = float(interval)
+        self.pids = sorted((pids or {}).items())
+        self.clk_tck = float(os.sysconf("SC_CLK_TCK"))
+        self._stop_event = threading.Event()
+
+    def _sample(self):
+        return (time.time(), read_cpu_ticks(), read_mem_used(),
+                [read_pid_ticks(pid) for _, pid in self.pids])
+
+    def _line(self, last, now):
+        elapsed = now[0] - last[0]
+        values = ["%.1f" % now[0]]
+        for old, new in zip(last[1], now[1]):
+            total = float(new[3] - old[3]) or 1.0
+            values.append("%.1f" % (100 * (new[1] - old[1]) / total))
+        old, new = last[1][0], now[1][0]
+        total = float(new[3] - old[3]) or 1.0
+        values.append("%.1f" % (100 * (new[2] - old[2]) / total))
+        values.append("%d" % now[2])
+        for old, new in zip(last[3], now[3]):
+            used = (new - old) / self.clk_tck
+            values.append("%.1f" % (100 * used / (elapsed or 1.0)))
+        return " ".join(values) + "\n"
+
+    def run(self):
+        result = open(self.filename, "w")
+        try:
+            last = self._sample()
+            names = ["time"] + [_[0] for _ in last[1]]
+            names += ["iowait", "mem_used"] + [_[0] for _ in self.pids]
+            result.write("# %s\n" % " ".join(names))
+            stopping = False
+            while not stopping:
+                stopping = self._stop_event.wait(self.interval)
+                # python 2.6 returns None from wait()
+                stopping = stopping or self._stop_event.is_set()
+                now = self._sample()
+                result.write(self._line(last, now))
+                result.flush()
+                last = now
+        finally:
+            result.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def load_series(filename):
+    """
+    Read a time series written by ProcSampler.
+
+    :param filename: the time series file
+    :return: dictionary of column name to list of values
+    """
+    names = []
+    series = {}
+    result = open(filename)
+    try:
+        for line in result:
+            if line.startswith("#"):
+                names = line[1:].split()
+                series = dict([(_, []) for _ in names])
+            elif line.strip():
+                for name, value in zip(names, line.split()):
+                    series[name].append(float(value))
+    finally:
+        result.close()
+    return series
+
+
+def series_mean(filename):
+    """
+    Get the mean of every column of a time series, but time.
+
+    :param filename: the time series file
+    """
+    means = {}
+    for name, values in load_series(filename).items():
+        if name != "time" and values:
+            means[name] = sum(values) / len(values)
+    return means
+
+
+def main(argv):
+    pids = dict([_.split("=", 1) for _ in argv[3:]])
+    sampler = ProcSampler(argv[1], argv[2], pids)
+
+    def stop(signum, frame):
+        sampler._stop_event.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    sampler.start()
+    # join() with a timeout so the signal handler gets to run
+    while sampler.is_alive():
+        sampler.join(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
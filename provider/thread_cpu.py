@@ -0,0 +1,108 @@
+"""
+Shared code for accounting host CPU time of qemu threads by role
+"""
+import os
+import time
+
+ROLES = ("vcpu", "vhost", "main", "iothread")
+
+
+def _read_ticks(path):
+    """
+    Get utime + stime in clock ticks from a /proc stat file.
+    """
+    try:
+        f = open(path)
+        try:
+            stat = f.read()
+        finally:
+            f.close()
+    except IOError:
+        return 0
+    # comm may contain spaces, the fields after it are fixed
+    fields = stat[stat.rfind(")") + 2:].split()
+    return int(fields[11]) + int(fields[12])
+
+
+def get_vhost_pids(qemu_pid):
+    """
+    Get the pids of the vhost-<qemu_pid> kernel threads.
+
+    :param qemu_pid: pid of the qemu process
+    """
+    name = "vhost-%s" % qemu_pid
+    pids = []
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            f = open("/proc/%s/comm" % pid)
+            try:
+                comm = f.read().strip()
+            finally:
+                f.close()
+        except IOError:
+            continue
+        if comm == name:
+            pids.append(int(pid))
+    return pids
+
+
+class ThreadCpu(object):
+
+    """
+    Account the host CPU time of a VM's threads per role.
+
+    Roles are vcpu (the vcpu thread ids of query-cpus), vhost (the
+    vhost-<pid> kernel threads), main (the qemu main loop/emulator thread)
+    and iothread (every other qemu thread). Threads which exit during the
+    window lose their time, threads created during it count from zero.
+    """
+
+    def __init__(self, vm):
+        """
+        :param vm: VM object
+        """
+        self.pid = int(vm.get_pid())
+        self.vcpus = set([int(_) for _ in vm.vcpu_threads])
+        self.clk_tck = float(os.sysconf("SC_CLK_TCK"))
+        self._start = None
+        self._start_time = None
+
+    def _role(self, tid):
+        if tid == self.pid:
+            return "main"
+        if tid in self.vcpus:
+            return "vcpu"
+        return "iothread"
+
+    def snapshot(self):
+        """
+        Get the cumulated ticks of every thread as {(role, tid): ticks}.
+        """
+        ticks = {}
+        task_dir = "/proc/%s/task" % self.pid
+        for tid in os.listdir(task_dir):
+            path = os.path.join(task_dir, tid, "stat")
+            ticks[(self._role(int(tid)), int(tid))] = _read_ticks(path)
+        for pid in get_vhost_pids(self.pid):
+            ticks[("vhost", pid)] = _read_ticks("/proc/%s/stat" % pid)
+        return ticks
+
+    def start(self):
+        self._start_time = time.time()
+        self._start = self.snapshot()
+
+    def stop(self):
+        """
+        Get the CPU seconds used by each role since start().
+
+        :return: (dict of role to CPU seconds, window length in seconds)
+        """
+        end = self.snapshot()
+        elapsed = time.time() - self._start_time
+        seconds = dict([(role, 0.0) for role in ROLES])
+        for key, ticks in end.items():
+            used = ticks - self._start.get(key, 0)
+            seconds[key[0]] += used / self.clk_tck
+        return seconds, elapsed
@@ -0,0 +1,51 @@
+#!/bin/sh
+# Send count packets of pkt_size bytes per pktgen thread as fast as
+# possible, one pktgen device (interface@N) per kernel thread.
+#
+# Usage: pktgen_pps.sh dst_ip dst_mac interface threads pkt_size count \
+#                      [clone_skb]
+
+if [ $# -lt 6 ]; then
+    echo "Usage: $0 dst_ip dst_mac interface threads pkt_size count" \
+         "[clone_skb]"
+    exit 1
+fi
+
+DST_IP=$1
+DST_MAC=$2
+IFACE=$3
+THREADS=$4
+PKT_SIZE=$5
+COUNT=$6
+CLONE_SKB=${7:-0}
+
+modprobe pktgen || exit 1
+
+pgset() {
+    echo "$1" > $PGDEV
+    if ! grep -q "Result: OK:" $PGDEV; then
+        grep "Result:" $PGDEV
+    fi
+}
+
+for i in $(seq 0 $(($THREADS - 1))); do
+    PGDEV=/proc/net/pktgen/kpktgend_$i
+    pgset "rem_device_all"
+    pgset "add_device $IFACE@$i"
+
+    PGDEV=/proc/net/pktgen/$IFACE@$i
+    pgset "count $COUNT"
+    pgset "clone_skb $CLONE_SKB"
+    pgset "pkt_size $PKT_SIZE"
+    pgset "delay 0"
+    pgset "dst $DST_IP"
+    pgset "dst_mac $DST_MAC"
+done
+
+# start returns when all threads sent their packets
+PGDEV=/proc/net/pktgen/pgctrl
+pgset "start"
+
+for i in $(seq 0 $(($THREADS - 1))); do
+    grep -A 1 "Result:" /proc/net/pktgen/$IFACE@$i
+done
@@ -1,9 +1,45 @@
 import logging
+import os
 import time
+import json
 from autotest.client import utils
 from autotest.client.shared import error
 from virttest import utils_netperf, utils_net, env_process, utils_misc
 from virttest import data_dir, utils_test
+from provider import perf_stats, perf_report
+
+
+def get_host_cpu_stat():
+    """
+    Return the softirq and total jiffies of all cpus in host /proc/stat
+    """
+    values = [int(_) for _ in
+              utils.read_one_line("/proc/stat").split()[1:]]
+    return values[6], sum(values)
+
+
+def load_baseline(path):
+    """
+    Load the stored TCP_CRR rates, an empty dict if there is none yet
+    """
+    if not os.path.isfile(path):
+        return {}
+    baseline_file = open(path)
+    try:
+        return json.load(baseline_file)
+    finally:
+        baseline_file.close()
+
+
+def save_baseline(path, baseline):
+    """
+    Store the TCP_CRR rates of every configuration
+    """
+    baseline_file = open(path, "w")
+    try:
+        json.dump(baseline, baseline_file, indent=4, sort_keys=True)
+    finally:
+        baseline_file.close()
 
 
 # This decorator makes the test function aware of context strings
@@ -21,15 +57,21 @@ def run(test, params, env):
     6) Transfer file between guest and host.
     7) Check the md5 of copied file.
 
+    With crr_measure = yes steps 5 to 7 measure TCP_CRR with host
+    nf_conntrack unloaded and loaded instead, a loaded host nf_conntrack
+    does not skip the case then.
+
     This is a sample QEMU test, so people can get used to some of the test APIs.
 
     :param test: QEMU test object.
     :param params: Dictionary with the test parameters.
     :param env: Dictionary with test environment.
     """
+    crr = params.get("crr_measure", "no") == "yes"
     msg = "Make sure nf_conntrack is disabled in host and guest."
     error.context(msg, logging.info)
-    if "nf_conntrack" in utils.system_output("lsmod"):
+    # crr_measure unloads and restores the host modules itself
+    if not crr and "nf_conntrack" in utils.system_output("lsmod"):
         err = "nf_conntrack load in host, skip this case"
         raise error.TestNAError(err)
 
@@ -114,6 +156,17 @@ def run(test, params, env):
                                                  client, port,
                                                  password=passwd,
                                                  compile_option="--enable-burst")
+    if crr:
+        try:
+            netperf_server.start()
+            crr_measure(test, params, netperf_client, netperf_server_ip)
+        finally:
+            netperf_server.stop()
+            netperf_client.package.env_cleanup(True)
+            if session:
+                session.close()
+        return
+
     try:
         error.base_context("Run netperf test between host and guest.")
         error.context("Start netserver in host.", logging.info)
@@ -133,3 +186,140 @@ def run(test, params, env):
         netperf_client.package.env_cleanup(True)
         if session:
             session.close()
+
+
+def get_host_modules(modules):
+    """
+    Return the modules of the list loaded in host
+    """
+    loaded = [_.split()[0] for _ in
+              utils.system_output("lsmod").splitlines()[1:] if _.strip()]
+    return [_ for _ in modules if _ in loaded]
+
+
+def unload_host_modules(modules):
+    """
+    Unload the modules in host one by one, users first
+
+    :return: the modules still loaded
+    """
+    for module in modules:
+        utils.system("modprobe -r %s" % module, ignore_status=True)
+    return get_host_modules(modules)
+
+
+def load_host_modules(modules):
+    """
+    Load the modules in host one by one, dependencies first
+
+    :return: the modules still not loaded
+    """
+    for module in reversed(modules):
+        utils.system("modprobe %s" % module, ignore_status=True)
+    loaded = get_host_modules(modules)
+    return [_ for _ in modules if _ not in loaded]
+
+
+def crr_measure(test, params, netperf_client, server_ip):
+    """
+    Measure TCP_CRR rates with host nf_conntrack unloaded and loaded
+
+    :param netperf_client: netperf client in guest
+    :param server_ip: address of the netserver in host
+    """
+    test_time = params.get("crr_test_time", "30")
+    repeat = int(params.get("crr_repeat", 3))
+    conntrack_rule = params.get("crr_conntrack_rule",
+                                "INPUT -m conntrack --ctstate NEW,ESTABLISHED"
+                                " -j ACCEPT")
+    conntrack_modules = params.get("crr_conntrack_modules",
+                                   "xt_conntrack nf_conntrack_ipv4 "
+                                   "nf_defrag_ipv4 nf_conntrack").split()
+    tolerance = float(params.get("crr_baseline_tolerance", 5))
+    baseline_path = params.get("crr_baseline_file")
+    baseline = {}
+    if baseline_path:
+        baseline = load_baseline(baseline_path)
+    # vhost is "on" or "vhost=on" depending on the cfg
+    config = "vhost_%s-queues_%s" % (params.get("vhost",
+                                                "off").split("=")[-1],
+                                     params.get("queues", 1))
+
+    update = params.get("crr_baseline_update", "no") == "yes"
+    write_baseline = baseline_path and (update or
+                                        not os.path.isfile(baseline_path))
+
+    table = perf_report.ResultTable(test, "tcp-crr-rates",
+                                    ["conntrack", "trans_rate", "ci95",
+                                     "softirq_pct", "baseline"])
+    regressions = []
+    orig_modules = get_host_modules(conntrack_modules)
+    try:
+        for conntrack in params.get("crr_conntrack_states",
+                                    "off on").split():
+            if conntrack == "on":
+                error.context("Load nf_conntrack in host", logging.info)
+                utils.system("modprobe nf_conntrack")
+                # connections are only tracked by hooks of a conntrack rule
+                utils.system("iptables -I %s" % conntrack_rule)
+            else:
+                error.context("Unload nf_conntrack in host", logging.info)
+                if "nf_conntrack" in unload_host_modules(conntrack_modules):
+                    raise error.TestError("Fail to unload nf_conntrack in "
+                                          "host, can not measure without it")
+            try:
+                rates = []
+                softirq, total = get_host_cpu_stat()
+                for i in range(repeat):
+                    error.context("Run TCP_CRR %s with conntrack %s" %
+                                  (i, conntrack), logging.info)
+                    option = "-t TCP_CRR -l %s -- -r 1,1" % test_time
+                    rates.append(perf_report.netperf_keyvals(
+                        netperf_client, server_ip, option,
+                        ["TRANSACTION_RATE"])["TRANSACTION_RATE"])
+                softirq_end, total_end = get_host_cpu_stat()
+            finally:
+                if conntrack == "on":
+                    utils.system("iptables -D %s" % conntrack_rule,
+                                 ignore_status=True)
+                    unload_host_modules([_ for _ in conntrack_modules
+                                         if _ not in orig_modules])
+
+            key = "%s-conntrack_%s" % (config, conntrack)
+            row = {"conntrack": conntrack,
+                   "trans_rate": perf_stats.mean(rates),
+                   "ci95": perf_stats.confidence_interval(rates),
+                   "softirq_pct": ((softirq_end - softirq) * 100.0 /
+                                   max(total_end - total, 1)),
+                   "baseline": baseline.get(key, 0.0)}
+            if update or not row["baseline"]:
+                if write_baseline:
+                    logging.info("Store %.2f as baseline of %s",
+                                 row["trans_rate"], key)
+                baseline[key] = row["trans_rate"]
+            elif row["trans_rate"] < row["baseline"] * (100 - tolerance) / 100:
+                regressions.append("%s: %.2f < baseline %.2f" %
+                                   (key, row["trans_rate"], row["baseline"]))
+            table.add(row, "conntrack-%s" % conntrack)
+    finally:
+        left = unload_host_modules([_ for _ in conntrack_modules
+                                    if _ not in orig_modules])
+        if left:
+            logging.warn("Fail to restore host modules, still loaded: %s",
+                         " ".join(left))
+        missing = load_host_modules(orig_modules)
+        if missing:
+            logging.warn("Fail to restore host modules, not loaded: %s",
+                         " ".join(missing))
+
+    # the baseline of this run is always kept with the results, the
+    # configured file is only updated on request
+    save_baseline(os.path.join(test.resultsdir, "tcp-crr-baseline.json"),
+                  baseline)
+    if write_baseline:
+        save_baseline(baseline_path, baseline)
+
+    table.log("TCP_CRR rates of %s" % config)
+    if regressions:
+        raise error.TestWarn("TCP_CRR rate below baseline: %s" %
+                             "; ".join(regressions))
@@ -4,6 +4,7 @@ import re
 from autotest.client import utils
 from autotest.client.shared import error
 from virttest import utils_net, utils_netperf, utils_misc, data_dir
+from provider import perf_report
 
 
 @error.context_aware
@@ -21,6 +22,12 @@ def run(test, params, env):
        message size.
     6) Compare UDP performance to make sure it is acceptable.
 
+    With zero_loss_search = yes, step 5 and 6 are replaced by a RFC2544 like
+    binary search of the highest offered rate with loss below loss_epsilon
+    for each message size, confirmed by a final longer trial at that rate.
+    When the confirmation loses messages the next lower rate without loss
+    in the search is confirmed instead.
+
     :param test: QEMU test object
     :param params: Dictionary with the test parameters
     :param env: Dictionary with test environment.
@@ -98,6 +105,12 @@ def run(test, params, env):
         s_path = server_path
         s_md5sum = md5sum
 
+    zero_loss = params.get("zero_loss_search", "no") == "yes"
+    netperf_options = {}
+    if zero_loss:
+        # the offered rate is paced with the -w/-b global options
+        netperf_options["compile_option"] = "--enable-intervals"
+
     if os_type == "windows":
         c_path = client_path_win
         c_md5sum = client_md5sum
@@ -112,7 +125,8 @@ def run(test, params, env):
                                                  c_md5sum, c_link,
                                                  client, port,
                                                  username=guest_username,
-                                                 password=guest_password)
+                                                 password=guest_password,
+                                                 **netperf_options)
 
     netperf_server = utils_netperf.NetperfServer(netserver_ip,
                                                  s_path,
@@ -120,7 +134,8 @@ def run(test, params, env):
                                                  s_link,
                                                  s_client, s_port,
                                                  username=s_username,
-                                                 password=s_password)
+                                                 password=s_password,
+                                                 **netperf_options)
 
     # Get range of message size.
     message_size = params.get("message_size_range", "580 590 1").split()
@@ -130,9 +145,98 @@ def run(test, params, env):
     m_size = start_size
     throughput = []
 
+    def udp_trial(size, burst, length):
+        """
+        Offer burst UDP messages of size bytes every interval for length
+        seconds, unpaced if burst is 0.
+
+        :return: tuple of sent messages and received messages
+        """
+        test_option = "-t UDP_STREAM -l %s" % length
+        if burst:
+            test_option += " -w %s -b %s" % (interval, burst)
+        test_option += " -- -m %s" % size
+        output = netperf_client.start(netserver_ip, test_option)
+        # sender: socket size, message size, time, okay, errors, throughput
+        # receiver: socket size, time, messages, throughput
+        sent = re.findall(r"^\s*\d+\s+\d+\s+[\d.]+\s+(\d+)\s+\d+\s+[\d.]+\s*$",
+                          output, re.M)
+        received = re.findall(r"^\s*\d+\s+[\d.]+\s+(\d+)\s+[\d.]+\s*$",
+                              output, re.M)
+        if not sent or not received:
+            txt = "Fail to get message counters for %s." % size
+            txt += " netperf client output: %s" % output
+            raise error.TestError(txt)
+        return int(sent[0]), int(received[0])
+
+    def loss_ratio(sent, received):
+        if not sent:
+            return 100.0
+        return (sent - received) * 100.0 / sent
+
+    def search_zero_loss(size):
+        """
+        Binary search the highest burst per interval without loss.
+        """
+        error.context("Search zero loss rate of size %s" % size,
+                      logging.info)
+        sent, received = udp_trial(size, 0, trial_time)
+        loss = loss_ratio(sent, received)
+        logging.info("Unpaced: sent %s received %s loss %.4f%%",
+                     sent, received, loss)
+        # the unpaced send rate is the upper bound of the search
+        high = max(1, int(sent * interval / (trial_time * 1000.0)))
+        low = 0
+        iterations = 1
+        # the bursts without loss in a trial, the confirmation falls back
+        # to the next lower one when the longer run loses messages
+        passed = []
+        if loss <= loss_epsilon:
+            low = high
+            passed.append(high)
+        while high - low > max(1, high * resolution / 100):
+            burst = (low + high) / 2
+            sent, received = udp_trial(size, burst, trial_time)
+            loss = loss_ratio(sent, received)
+            iterations += 1
+            logging.info("Burst %s per %sms: sent %s received %s "
+                         "loss %.4f%%", burst, interval, sent, received, loss)
+            if loss <= loss_epsilon:
+                low = burst
+                passed.append(burst)
+            else:
+                high = burst
+
+        result = {"size": size, "rate": 0, "mbps": 0.0, "loss": "-",
+                  "iterations": iterations, "confirmed": "no"}
+        for burst in sorted(passed, reverse=True):
+            error.context("Confirm zero loss burst %s of size %s" %
+                          (burst, size), logging.info)
+            sent, received = udp_trial(size, burst, confirm_time)
+            result["loss"] = loss_ratio(sent, received)
+            result["iterations"] += 1
+            if result["loss"] <= loss_epsilon:
+                result["confirmed"] = "yes"
+                result["rate"] = burst * 1000 / interval
+                result["mbps"] = result["rate"] * size * 8 / 1000000.0
+                break
+            logging.info("Burst %s lost %.4f%% in the confirmation run",
+                         burst, result["loss"])
+        return result
+
+    interval = int(params.get("zero_loss_interval", 10))
+    trial_time = int(params.get("zero_loss_trial_time", 10))
+    confirm_time = int(params.get("zero_loss_confirm_time", 60))
+    loss_epsilon = float(params.get("loss_epsilon", 0))
+    resolution = float(params.get("zero_loss_resolution", 1))
+    zero_loss_results = []
+
     try:
         error.context("Start netperf_server", logging.info)
         netperf_server.start()
+        while zero_loss and m_size <= end_size:
+            zero_loss_results.append(search_zero_loss(m_size))
+            m_size += step
         # Run netperf with message size defined in range.
         msg = "Detail result of netperf test with different packet size.\n"
         while(m_size <= end_size):
@@ -157,7 +261,26 @@ def run(test, params, env):
     finally:
         netperf_server.stop()
 
-    file(os.path.join(test.debugdir, "udp_results"), "w").write(msg)
+    if zero_loss:
+        error.context("Report zero loss rates.", logging.info)
+        keys = ["size", "rate", "mbps", "loss", "iterations", "confirmed"]
+        table = perf_report.ResultTable(test, "udp_zero_loss", keys,
+                                        fbase="4")
+        for result in zero_loss_results:
+            table.add(result, str(result["size"]))
+        table.log("Zero loss UDP rates")
+        unconfirmed = [str(_["size"]) for _ in zero_loss_results
+                       if _["confirmed"] != "yes"]
+        if unconfirmed:
+            session.close()
+            raise error.TestWarn("Zero loss rate not confirmed for sizes "
+                                 "%s" % ", ".join(unconfirmed))
+        session.close()
+        return
+
+    udp_results = open(os.path.join(test.debugdir, "udp_results"), "w")
+    udp_results.write(msg)
+    udp_results.close()
     failratio = float(params.get("failratio", 0.3))
     error.context("Compare UDP performance.", logging.info)
     for i in range(len(throughput) - 1):
@@ -1,8 +1,25 @@
 import logging
+import re
 import time
 import random
-from virttest import utils_test, aexpect, utils_net
+from virttest import utils_test, aexpect, utils_net, utils_misc
 from autotest.client.shared import error, utils
+from provider import perf_stats, perf_report
+
+
+def parse_ping_gap(output):
+    """
+    Get the longest gap between replies of a ping -D output
+
+    :return: tuple of the longest gap in seconds, replies and lost replies
+    """
+    replies = [(float(ts), int(seq)) for ts, seq in
+               re.findall(r"^\[([\d.]+)\].*icmp_seq=(\d+)", output, re.M)]
+    if len(replies) < 2:
+        return 0.0, len(replies), 0
+    gap = max([b[0] - a[0] for a, b in zip(replies, replies[1:])])
+    lost = replies[-1][1] - replies[0][1] + 1 - len(replies)
+    return gap, len(replies), lost
 
 
 def run(test, params, env):
@@ -15,6 +32,8 @@ def run(test, params, env):
     4) Repeatedly put down/up interfaces by set_link
     5) Execute file transfer test between guest and host.
 
+    With bonding_measure = yes steps 3 to 5 benchmark every bonding mode.
+
     :param test: Kvm test object.
     :param params: Dictionary with the test parameters.
     :param env: Dictionary with test environment.
@@ -28,30 +47,54 @@ def run(test, params, env):
                                           vm.get_mac_address(vlan))
                for vlan, nic in enumerate(vm.virtnet)]
 
-    # get params of bonding
-    nm_stop_cmd = "pidof NetworkManager && service NetworkManager stop; true"
-    session_serial.cmd_output_safe(nm_stop_cmd)
-    modprobe_cmd = "modprobe bonding"
-    bonding_params = params.get("bonding_params")
-    if bonding_params:
-        modprobe_cmd += " %s" % bonding_params
-    session_serial.cmd_output_safe(modprobe_cmd)
-    session_serial.cmd_output_safe("ifconfig bond0 up")
-    setup_cmd = "ifenslave bond0 " + " ".join(ifnames)
-    session_serial.cmd_output_safe(setup_cmd)
-    # do a pgrep to check if dhclient has already been running
-    pgrep_cmd = "pgrep dhclient"
-    try:
-        session_serial.cmd_output_safe(pgrep_cmd)
-    # if dhclient is there, killl it
-    except aexpect.ShellCmdError:
-        logging.info("it's safe to run dhclient now")
-    else:
-        logging.info("dhclient already is running,kill it")
-        session_serial.cmd_output_safe("killall -9 dhclient")
-        time.sleep(1)
+    def setup_bond(bonding_params):
+        """
+        Load bonding with bonding_params and enslave all nics to bond0
+        """
+        # get params of bonding
+        nm_stop_cmd = ("pidof NetworkManager && service NetworkManager stop;"
+                       " true")
+        session_serial.cmd_output_safe(nm_stop_cmd)
+        modprobe_cmd = "modprobe bonding"
+        if bonding_params:
+            modprobe_cmd += " %s" % bonding_params
+        session_serial.cmd_output_safe(modprobe_cmd)
+        session_serial.cmd_output_safe("ifconfig bond0 up")
+        setup_cmd = "ifenslave bond0 " + " ".join(ifnames)
+        session_serial.cmd_output_safe(setup_cmd)
+        # do a pgrep to check if dhclient has already been running
+        pgrep_cmd = "pgrep dhclient"
+        try:
+            session_serial.cmd_output_safe(pgrep_cmd)
+        # if dhclient is there, killl it
+        except aexpect.ShellCmdError:
+            logging.info("it's safe to run dhclient now")
+        else:
+            logging.info("dhclient already is running,kill it")
+            session_serial.cmd_output_safe("killall -9 dhclient")
+            time.sleep(1)
+
+        session_serial.cmd_output_safe("dhclient bond0")
+
+    def teardown_bond():
+        """
+        Release the slaves and unload bonding
+        """
+        session_serial.cmd_output_safe("ifenslave -d bond0 " +
+                                       " ".join(ifnames))
+        session_serial.cmd_output_safe("kill -9 `pgrep dhclient`; true")
+        session_serial.cmd_output_safe("ifconfig bond0 down; "
+                                       "rmmod bonding; true")
+
+    if params.get("bonding_measure", "no") == "yes":
+        try:
+            bonding_measure(test, params, vm, session_serial, ifnames,
+                            setup_bond, teardown_bond)
+        finally:
+            session_serial.close()
+        return
 
-    session_serial.cmd_output_safe("dhclient bond0")
+    setup_bond(params.get("bonding_params"))
 
     #get_bonding_nic_mac and ip
     try:
@@ -81,3 +124,93 @@ def run(test, params, env):
     finally:
         session_serial.sendline("ifenslave -d bond0 " + " ".join(ifnames))
         session_serial.sendline("kill -9 `pgrep dhclient`")
+
+
+def bonding_measure(test, params, vm, session, ifnames, setup_bond,
+                    teardown_bond):
+    """
+    Measure the throughput and the failover time of every bonding mode
+
+    :param session: guest serial session
+    :param ifnames: guest interface names of the slaves, in nic order
+    :param setup_bond: function to setup bond0 with module parameters
+    :param teardown_bond: function to remove bond0
+    """
+    host_ip = utils_net.get_host_ip_address(params)
+    test_time = int(params.get("bonding_test_time", 30))
+    sessions = params.get("bonding_sessions", "4")
+    failover_time = int(params.get("bonding_failover_time", 10))
+    ping_interval = params.get("bonding_ping_interval", "0.001")
+    # without link monitoring bonding never fails over
+    bonding_params = params.get("bonding_measure_params", "miimon=100")
+    host_shell = {"shell_client": params.get("shell_client", "ssh"),
+                  "shell_port": "22", "username": "root",
+                  "password": params.get("hostpasswd", "redhat")}
+
+    def get_tx_bytes():
+        cmd = ";".join(["cat /sys/class/net/%s/statistics/tx_bytes" % _
+                        for _ in ifnames])
+        return [int(_) for _ in session.cmd_output_safe(cmd).split()]
+
+    table = perf_report.ResultTable(test, "bonding-modes",
+                                    ["mode", "throughput", "slave_jain",
+                                     "failover_ms", "lost"], base="14")
+    for mode in params.get("bonding_modes", "balance-rr "
+                           "active-backup").split():
+        error.context("Setup bond0 with mode %s" % mode, logging.info)
+        setup_bond("mode=%s %s" % (mode, bonding_params))
+        try:
+            guest_ip = vm.get_address()
+            session.cmd_output_safe("iptables -F; true")
+            netperf_server, netperf_client = perf_report.netperf_pair(
+                params, host_ip, guest_ip, server_shell=host_shell)
+            try:
+                netperf_server.start()
+                error.context("Run %s TCP_STREAM sessions over bond0" %
+                              sessions, logging.info)
+                before = get_tx_bytes()
+                start_time = time.time()
+                netperf_client.bg_start(host_ip, "-t TCP_STREAM -l %s" %
+                                        test_time, sessions)
+                utils_misc.wait_for(
+                    lambda: not netperf_client.is_netperf_running(),
+                    timeout=test_time + 60, first=test_time, step=1)
+                elapsed = time.time() - start_time
+                slaves = [b - a for a, b in zip(before, get_tx_bytes())]
+            finally:
+                perf_report.netperf_cleanup(netperf_server, netperf_client)
+            row = {"mode": mode,
+                   "throughput": sum(slaves) * 8 / elapsed / 1000000,
+                   "slave_jain": perf_stats.jain_index(slaves)}
+
+            active = session.cmd_output_safe(
+                "cat /sys/class/net/bond0/bonding/active_slave").strip()
+            index = active in ifnames and ifnames.index(active) or 0
+            device_id = vm.virtnet[index].device_id
+            error.context("Drop slave %s while pinging %s" %
+                          (ifnames[index], guest_ip), logging.info)
+            ping_thread = utils.InterruptedThread(
+                utils.system_output, ("ping -D -i %s -w %s %s" %
+                                      (ping_interval, failover_time,
+                                       guest_ip),),
+                {"ignore_status": True, "timeout": failover_time + 30})
+            ping_thread.start()
+            try:
+                time.sleep(2)
+                vm.set_link(device_id, up=False)
+            finally:
+                try:
+                    output = ping_thread.join()
+                finally:
+                    vm.set_link(device_id, up=True)
+            gap, replies, lost = parse_ping_gap(output)
+            if not replies:
+                raise error.TestFail("No reply from %s in bonding mode "
+                                     "%s" % (guest_ip, mode))
+            row["failover_ms"] = gap * 1000
+            row["lost"] = lost
+            table.add(row, mode)
+        finally:
+            teardown_bond()
+
+    table.log("Bonding modes (Mbit/s, ms)")
@@ -1,7 +1,43 @@
 import logging
+import os
 import re
+import time
+from autotest.client import utils
 from autotest.client.shared import error
 from virttest import utils_net, utils_test, utils_misc
+from provider import perf_report
+
+# cookie of the generated flows, so they can be deleted alone
+SCALE_COOKIE = "0x2544"
+
+
+def write_scale_flows(path, count, subtables=8):
+    """
+    Write count distinct tcp drop flows to a ovs-ofctl add-flows file.
+
+    The flows match sources of the 198.18.0.0/15 benchmark network, so they
+    grow the flow table without matching the guests' traffic. They are
+    spread round robin over source prefixes of subtables different lengths,
+    /32 down to /18 in steps of 2, so the classifier has to look up that
+    many subtables like with a real flow table.
+
+    :param path: flow file path
+    :param count: number of flows
+    :param subtables: number of different source prefix lengths, 1 to 8
+    """
+    flow_file = open(path, "w")
+    for i in range(count):
+        plen = 32 - 2 * (i % subtables)
+        index = i / subtables
+        # distinct networks of that prefix length in 198.18.0.0/15
+        networks = 2 ** (plen - 15)
+        address = (198 << 24 | 18 << 16) + (index % networks << 32 - plen)
+        nw_src = ".".join([str(address >> _ & 255) for _ in (24, 16, 8, 0)])
+        tp_dst = 1024 + index / networks
+        flow_file.write("cookie=%s,priority=100,tcp,nw_src=%s/%d,tp_dst=%d,"
+                        "actions=drop\n" % (SCALE_COOKIE, nw_src, plen,
+                                            tp_dst))
+    flow_file.close()
 
 
 @error.context_aware
@@ -12,6 +48,9 @@ def run(test, params, env):
         2. Set openflow rules
         3. Run ping test, nc(tcp, udp) test, check whether openflow rules take
            effect.
+
+    With flow_scale = yes steps 2 and 3 benchmark growing flow tables.
+
     Params:
         :param test: QEMU test object
         :param params: Dictionary with the test parameters
@@ -149,8 +188,18 @@ def run(test, params, env):
         sessions.append(vm.wait_for_login(timeout=timeout))
         addresses.append(vm.get_address())
 
-    # set openflow rules:
     br_name = params.get("netdst", "ovs0")
+    if params.get("flow_scale", "no") == "yes":
+        try:
+            flow_scale(test, params, vms, sessions, br_name)
+        finally:
+            utils_net.openflow_manager(br_name, "del-flows",
+                                       "cookie=%s/-1" % SCALE_COOKIE)
+            for session in sessions:
+                session.close()
+        return
+
+    # set openflow rules:
     f_protocol = params.get("flow", "arp")
     f_base_options = "%s,nw_src=%s,nw_dst=%s" % (f_protocol, addresses[0],
                                                  addresses[1])
@@ -200,3 +249,67 @@ def run(test, params, env):
         utils_net.openflow_manager(br_name, "del-flows", f_protocol)
         for session in sessions:
             session.close()
+
+
+def flow_scale(test, params, vms, sessions, br_name):
+    """
+    Measure the guest to guest performance for growing flow tables
+
+    :param vms: the client and the server vm
+    :param sessions: sessions of vms
+    :param br_name: ovs bridge of the guests
+    """
+    for session in sessions:
+        session.cmd("service iptables stop; iptables -F",
+                    ignore_all_errors=True)
+    server_ip = vms[1].get_address()
+    netperf_server, netperf_client = perf_report.netperf_pair(
+        params, server_ip, vms[0].get_address())
+    test_time = params.get("flow_scale_time", "30")
+    subtables = int(params.get("flow_scale_subtables", 8))
+    flow_path = os.path.join(test.tmpdir, "scale_flows")
+
+    table = perf_report.ResultTable(test, "openflow-scale",
+                                    ["flows", "install_s", "install_rate",
+                                     "throughput", "thu_ratio", "lat_mean",
+                                     "lat_p99"])
+    base_thu = None
+    try:
+        netperf_server.start()
+        for count in params.get("flow_scale_counts",
+                                "0 1000 10000 100000").split():
+            count = int(count)
+            row = {"flows": count, "install_s": 0.0, "install_rate": 0.0}
+            utils_net.openflow_manager(br_name, "del-flows",
+                                       "cookie=%s/-1" % SCALE_COOKIE)
+            if count:
+                error.context("Bulk load %s flows to %s" % (count, br_name),
+                              logging.info)
+                write_scale_flows(flow_path, count, subtables)
+                start_time = time.time()
+                utils_net.openflow_manager(br_name, "add-flows", flow_path)
+                row["install_s"] = time.time() - start_time
+                row["install_rate"] = count / row["install_s"]
+                output = utils.system_output("ovs-ofctl dump-aggregate %s "
+                                             "cookie=%s/-1" % (br_name,
+                                                               SCALE_COOKIE))
+                installed = re.findall(r"flow_count=(\d+)", output)
+                if not installed or int(installed[0]) != count:
+                    raise error.TestError("Expect %s flows on %s, got: %s" %
+                                          (count, br_name, output))
+
+            error.context("Run netperf with %s flows" % count, logging.info)
+            row["throughput"] = perf_report.netperf_throughput(
+                netperf_client, server_ip, test_time,
+                size=params.get("flow_scale_stream_size", "16384"))
+            if base_thu is None:
+                base_thu = row["throughput"]
+            row["thu_ratio"] = row["throughput"] / base_thu
+            row.update(perf_report.netperf_latency(
+                netperf_client, server_ip, test_time,
+                size=params.get("flow_scale_rr_size", "1")))
+            table.add(row, "flows-%s" % count)
+    finally:
+        perf_report.netperf_cleanup(netperf_server, netperf_client)
+
+    table.log("Flow table scale")
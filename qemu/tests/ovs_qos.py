@@ -4,9 +4,11 @@ import time
 import glob
 import shutil
 import logging
+import threading
 from autotest.client import os_dep
 from autotest.client.shared import error, utils
 from virttest import utils_netperf, data_dir
+from provider import perf_stats, perf_report
 
 
 @error.context_aware
@@ -22,6 +24,8 @@ def run(test, params, env):
     6) Run step 4 again.
     7) Verify vm through out.
 
+    With qos_sampling = yes the received rate is sampled during each trial.
+
     :param test: Kvm test object
     :param params: Dictionary with the test parameters.
     :param env: Dictionary with test environment.
@@ -59,6 +63,57 @@ def run(test, params, env):
             set_ovs_port_attr(iface, k, v)
             time.sleep(0.1)
 
+    def sample_tx_bytes(tap, interval, samples, stop_event):
+        """
+        Append (timestamp, tx_bytes) of tap to samples every interval
+        seconds until stop_event is set.
+        """
+        path = "/sys/class/net/%s/statistics/tx_bytes" % tap
+        while not stop_event.isSet():
+            counter_file = open(path)
+            try:
+                samples.append((time.time(), int(counter_file.read())))
+            finally:
+                counter_file.close()
+            stop_event.wait(interval)
+
+    def analyze_samples(samples, rate):
+        """
+        Get the rate series in kbps and its accuracy against the policing
+        rate.
+
+        :param samples: list of (timestamp, tx_bytes)
+        :param rate: ingress_policing_rate in kbps
+        :return: tuple of series of (elapsed, kbps) and dict of peak, p99,
+                 mean and settling time (-1 if never settled) of the traffic
+                 window
+        """
+        series = []
+        start = samples[0][0]
+        for (t0, b0), (t1, b1) in zip(samples, samples[1:]):
+            series.append((t1 - start, (b1 - b0) * 8 / 1000.0 / (t1 - t0)))
+        # the last interval is cut by the end of netperf
+        series = series[:-1] or series
+        # only the samples from the first to the last one with traffic, the
+        # idle samples before netperf starts and after it ends are not
+        # part of the policed flow
+        active = [i for i, (_, kbps) in enumerate(series)
+                  if kbps > rate * active_threshold / 100]
+        window = series
+        if active:
+            window = series[active[0]:active[-1] + 1]
+        rates = [_[1] for _ in window]
+        # settled once every later sample stays within the tolerance
+        settle = -1
+        for elapsed, kbps in reversed(window):
+            if abs(kbps - rate) > rate * settle_tolerance / 100:
+                break
+            settle = elapsed - window[0][0]
+        return series, {"peak": max(rates + [0]),
+                        "p99": perf_stats.percentile(rates, 99),
+                        "mean": perf_stats.mean(rates),
+                        "settle": settle}
+
     def get_throughout(netperf_server, server_vm, netperf_client,
                        client_vm, client_options=" -l 60"):
         """
@@ -79,7 +134,20 @@ def run(test, params, env):
         error.context("Set '%s' as netperf client" % client_vm.name,
                       logging.info)
         server_ip = server_vm.get_address()
-        output = netperf_client.start(server_ip, client_options)
+        if sampling:
+            del samples[:]
+            stop_event = threading.Event()
+            sampler = threading.Thread(target=sample_tx_bytes,
+                                       args=(server_vm.get_ifname(),
+                                             sample_interval, samples,
+                                             stop_event))
+            sampler.start()
+        try:
+            output = netperf_client.start(server_ip, client_options)
+        finally:
+            if sampling:
+                stop_event.set()
+                sampler.join()
         regex = r"\d+\s+\d+\s+\d+\s+[\d.]+\s+([\d.]+)"
         try:
             throughout = float(re.search(regex, output, re.M).groups()[0])
@@ -205,6 +273,19 @@ def run(test, params, env):
     extra_options = params.get("netperf_client_options", " -l 60")
     rate_brust_pairs = params.get("rate_brust_pairs").split()
     rate_brust_pairs = map(lambda x: map(int, x.split(',')), rate_brust_pairs)
+    if params.get("qos_rate_sweep"):
+        burst_ratio = float(params.get("qos_burst_ratio", 10))
+        rate_brust_pairs = [[int(_), int(int(_) * burst_ratio / 100)]
+                            for _ in params.get("qos_rate_sweep").split()]
+    sampling = params.get("qos_sampling", "no") == "yes"
+    sample_interval = float(params.get("qos_sample_interval", 0.1))
+    settle_tolerance = float(params.get("qos_settle_tolerance", 10))
+    active_threshold = float(params.get("qos_active_threshold", 10))
+    samples = []
+    if sampling:
+        accuracy = perf_report.ResultTable(test, "ovs-qos-accuracy",
+                                           ["rate", "burst", "mean", "peak",
+                                            "p99", "overshoot", "settle"])
     results = []
     try:
         netperf_clients, netperf_servers = setup_netperf_env()
@@ -222,6 +303,20 @@ def run(test, params, env):
                 iface = client_vm.get_ifname()
                 clear_qos_setting(iface)
                 results.append([iface, throughout, rate, burst])
+                if sampling and len(samples) > 1:
+                    series, row = analyze_samples(samples, rate)
+                    row.update({"rate": rate, "burst": burst})
+                    row["overshoot"] = (row["peak"] - rate) * 100.0 / rate
+                    accuracy.add(row, "%s-%s" % (rate, burst),
+                                 accuracy.keys[2:])
+                    series_file = open(os.path.join(
+                        test.resultsdir,
+                        "ovs-qos-series.%s-%s" % (rate, burst)), "w")
+                    series_file.write("".join(["%.3f %.2f\n" % _
+                                               for _ in series]))
+                    series_file.close()
+        if sampling:
+            accuracy.log("QoS accuracy (kbps, %, s)")
         report_test_results(results)
     finally:
         for f in glob.glob("/var/log/openvswith/*.log"):
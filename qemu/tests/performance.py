@@ -1,69 +1,144 @@
 import os
 import re
-import commands
+import logging
 import glob
+import json
 import shutil
-import shelve
-import threading
-from Queue import Queue
 from autotest.client.shared import error
 from autotest.client import utils
 from virttest import utils_test, utils_misc, data_dir
-
-
-def cmd_runner_monitor(vm, monitor_cmd, test_cmd, guest_path, timeout=300):
+from provider import proc_sampler, thread_cpu
+
+RESULTS_CATALOG = "performance_catalog.jsonl"
+
+FFSB_PROFILE = """time=%(time)s
+alignio=1
+directio=%(direct)s
+
+[filesystem0]
+\tlocation=%(location)s
+%(filesystem)s
+[end0]
+
+[threadgroup0]
+\tnum_threads=%(threads)s
+
+%(threadgroup)s
+
+\t[stats]
+\t\tenable_stats=1
+\t\tenable_range=1
+
+%(ranges)s
+\t[end]
+[end0]
+"""
+
+FFSB_RANGES = ["0.00", "0.01", "0.02", "0.05", "0.10", "0.20", "0.50",
+               "1.00", "2.00", "5.00", "10.00", "20.00", "50.00", "100.00",
+               "200.00", "500.00", "1000.00", "2000.00", "5000.00",
+               "10000.00"]
+
+# ffsb workload kinds: (filesystem0 options, threadgroup0 options)
+FFSB_WORKLOADS = {
+    "file_prepare": (["num_files=1024", "min_filesize=%(file_size)s",
+                      "max_filesize=%(file_size)s", "reuse=1"],
+                     ["readall_weight=1", "read_blocksize=%(block_size)s"]),
+    "random_reads": (["num_files=1024", "min_filesize=%(file_size)s",
+                      "max_filesize=%(file_size)s", "reuse=1"],
+                     ["read_random=1", "read_weight=1", "read_size=5MB",
+                      "read_blocksize=%(block_size)s"]),
+    "random_write": (["num_files=1024", "min_filesize=%(file_size)s",
+                      "max_filesize=%(file_size)s", "reuse=0"],
+                     ["write_random=1", "write_weight=1", "write_size=5MB",
+                      "write_blocksize=%(block_size)s"]),
+    "sequential_reads": (["num_files=1024", "min_filesize=%(file_size)s",
+                          "max_filesize=%(file_size)s", "reuse=1"],
+                         ["readall_weight=1",
+                          "read_blocksize=%(block_size)s"]),
+    "large_file_creates": (["min_filesize=%(file_size)s",
+                            "max_filesize=%(file_size)s", "reuse=0"],
+                           ["create_weight=1",
+                            "write_blocksize=%(block_size)s"]),
+    "mail_server": (["num_files=1000000", "num_dirs=1000",
+                     "size_weight 1KB 10", "size_weight 2KB 15",
+                     "size_weight 4KB 16", "size_weight 8KB 16",
+                     "size_weight 16KB 15", "size_weight 32KB 10",
+                     "size_weight 64KB 8", "size_weight 128KB 4",
+                     "size_weight 256KB 3", "size_weight 512KB 2",
+                     "size_weight 1MB 1"],
+                    ["readall_weight=4", "create_fsync_weight=2",
+                     "delete_weight=1", "write_size=%(block_size)s",
+                     "write_blocksize=%(block_size)s",
+                     "read_size=%(block_size)s",
+                     "read_blocksize=%(block_size)s"]),
+}
+
+# iozone workload kinds: (default file size, default direct io)
+IOZONE_WORKLOADS = {
+    "incache": ("0.9mem", "no"),
+    "outcache": ("2mem", "no"),
+    "dio": ("0.9mem", "yes"),
+}
+
+
+def cmd_runner_monitor(vm, test_cmd, guest_path, interval=1, timeout=300,
+                       python=None):
     """
     For record the env information such as cpu utilization, meminfo while
     run guest test in guest.
     @vm: Guest Object
-    @monitor_cmd: monitor command running in backgroud
     @test_cmd: test suit run command
     @guest_path: path in guest to store the test result and monitor data
-    @timeout: longest time for monitor running
+    @interval: seconds between two samples of the host and guest monitor
+    @timeout: longest time for test running
+    @python: guest interpreter of the monitor agent, the first of python
+             and python3 found in the guest by default
     Return: tag the suffix of the results
     """
-    def thread_kill(cmd, p_file):
-        fd = shelve.open(p_file)
-        o = commands.getoutput("pstree -p %s" % fd["pid"])
-        tmp = re.split("\s+", cmd)[0]
-        pid = re.findall("%s.(\d+)" % tmp, o)[0]
-        s, o = commands.getstatusoutput("kill -9 %s" % pid)
-        fd.close()
-        return (s, o)
-
-    def monitor_thread(m_cmd, p_file, r_file):
-        fd = shelve.open(p_file)
-        fd["pid"] = os.getpid()
-        fd.close()
-        os.system("%s &> %s" % (m_cmd, r_file))
-
-    def test_thread(session, m_cmd, t_cmd, p_file, flag, timeout):
-        flag.put(True)
-        s, o = session.cmd_status_output(t_cmd, timeout)
-        if s != 0:
-            raise error.TestFail("Test failed or timeout: %s" % o)
-        if not flag.empty():
-            flag.get()
-            thread_kill(m_cmd, p_file)
-
-    kill_thread_flag = Queue(1)
     session = utils_test.wait_for_login(vm, 0, 300, 0, 2)
+    control_session = vm.wait_for_login()
     tag = vm.instance
-    pid_file = "/tmp/monitor_pid_%s" % tag
-    result_file = "/tmp/host_monitor_result_%s" % tag
-
-    monitor = threading.Thread(target=monitor_thread, args=(monitor_cmd,
-                                                            pid_file, result_file))
-    test_runner = threading.Thread(target=test_thread, args=(session,
-                                                             monitor_cmd, test_cmd, pid_file,
-                                                             kill_thread_flag, timeout))
-    monitor.start()
-    test_runner.start()
-    monitor.join(int(timeout))
-    if not kill_thread_flag.empty():
-        kill_thread_flag.get()
-        thread_kill(monitor_cmd, pid_file)
-        thread_kill("sh", pid_file)
+    qemu_pid = vm.get_pid()
+    pids = {"qemu": qemu_pid}
+    for index, pid in enumerate(thread_cpu.get_vhost_pids(qemu_pid)):
+        pids["vhost%s" % index] = pid
+    host_sampler = proc_sampler.ProcSampler(
+        "/tmp/host_monitor_result_%s" % tag, interval, pids)
+
+    if not python:
+        python = "$(command -v python || command -v python3)"
+    agent_cmd = "nohup %s /tmp/proc_sampler.py %s_monitor %s" % (
+        python, guest_path, interval)
+    agent_pid = control_session.cmd_output(
+        "%s > /dev/null 2>&1 & echo $!" % agent_cmd).strip()
+    if control_session.cmd_status("sleep 1; kill -0 %s" % agent_pid) != 0:
+        control_session.close()
+        session.close()
+        raise error.TestError("Guest monitor agent exited right after its "
+                              "start: %s" % agent_cmd)
+    host_sampler.start()
+    try:
+        s, o = session.cmd_status_output(test_cmd, timeout)
+        if s != 0:
+            raise error.TestFail("Test failed or timeout: %s" % o)
+    finally:
+        host_sampler.stop()
+        # The agent writes the last interval and exits on SIGTERM, a failing
+        # stop must not hide the result of the test command
+        try:
+            s = control_session.cmd_status("kill %s; while kill -0 %s "
+                                           "2> /dev/null; do sleep 0.1; "
+                                           "done" % (agent_pid, agent_pid),
+                                           timeout=60)
+            if s != 0:
+                logging.warn("Fail to stop the guest monitor agent %s",
+                             agent_pid)
+        except Exception, err:
+            logging.warn("Fail to stop the guest monitor agent %s: %s",
+                         agent_pid, err)
+        control_session.close()
+        session.close()
 
     guest_result_file = "/tmp/guest_result_%s" % tag
     guest_monitor_result_file = "/tmp/guest_monitor_result_%s" % tag
@@ -72,6 +147,185 @@ def cmd_runner_monitor(vm, monitor_cmd, test_cmd, guest_path, timeout=300):
     return tag
 
 
+def catalog_add(topdir, outputdir, results_dir, threads=""):
+    """
+    Append the result files of a run to the results catalog of topdir.
+
+    The catalog only locates the result files, the summary still parses
+    the marks and monitor values from the files.
+
+    :param topdir: directory of the results tree the summary reads
+    :param outputdir: output directory of the run
+    :param results_dir: directory with the result files of the run
+    :param threads: thread count of the run, empty if not a sweep point
+    """
+    case_dir = re.split("/", outputdir)[-1]
+    category = re.sub("\.repeat\d+", "", case_dir.split(".performance.")[-1])
+    repeat = re.findall("repeat\d+", outputdir)
+    record = {"case_type": category.split(".")[0],
+              "category": category,
+              "repeat": repeat and repeat[0] or "",
+              "threads": threads,
+              "dir": results_dir,
+              "files": sorted(os.listdir(results_dir))}
+    catalog = open(os.path.join(topdir, RESULTS_CATALOG), "a")
+    catalog.write("%s\n" % json.dumps(record))
+    catalog.close()
+
+
+def catalog_query(topdir, case_type, repeat=""):
+    """
+    Get the cataloged runs of case_type from the catalog of topdir.
+
+    :param topdir: directory of the results tree
+    :param case_type: case type of the runs
+    :param repeat: only the runs of this repeat, all runs if empty
+    :return: list of the catalog records of the runs, the last run of every
+             result directory that still exists, empty if no run of
+             case_type is cataloged
+    """
+    catalog_path = os.path.join(topdir, RESULTS_CATALOG)
+    if not os.path.isfile(catalog_path):
+        return []
+    index = {}
+    catalog = open(catalog_path, "r")
+    for line in catalog:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        index.setdefault((record["case_type"], record["repeat"]),
+                         []).append(record)
+    catalog.close()
+    results = []
+    for key in sorted(index.keys()):
+        if key[0] != case_type or (repeat and key[1] != repeat):
+            continue
+        runs = dict([(_["dir"], _) for _ in index[key]])
+        results += [runs[_] for _ in sorted(runs) if os.path.isdir(_)]
+    return results
+
+
+def ffsb_profile(params, kind, block_size, threads):
+    """
+    Build the ffsb profile of a sweep point.
+
+    :param params: Dictionary with the kind specific test parameters
+    :param kind: ffsb workload kind, a key of FFSB_WORKLOADS
+    :param block_size: io block size, like 8k
+    :param threads: number of threads
+    :return: the profile text
+    """
+    if kind not in FFSB_WORKLOADS:
+        raise error.TestError("Unknown ffsb workload '%s'" % kind)
+    sizes = {"file_size": params.get("perf_file_size", "100MB"),
+             "block_size": "%sB" % block_size.upper()}
+    filesystem, threadgroup = FFSB_WORKLOADS[kind]
+    ranges = ["\t\tmsec_range %7s %9s" % _
+              for _ in zip(FFSB_RANGES[:-1], FFSB_RANGES[1:])]
+    return FFSB_PROFILE % {
+        "time": params.get("perf_time", "300"),
+        "direct": int(params.get("perf_direct", "yes") == "yes"),
+        "location": params.get("perf_location", "/mnt/ffsb1"),
+        "filesystem": "\n".join(["\t%s" % (_ % sizes) for _ in filesystem]),
+        "threads": threads,
+        "threadgroup": "\n".join(["\t%s" % (_ % sizes)
+                                  for _ in threadgroup]),
+        "ranges": "\n".join(ranges)}
+
+
+def iozone_cmd(params, kind, block_size, threads, mem_kb):
+    """
+    Build the iozone command line of a sweep point.
+
+    The file size is either an absolute size or a multiple of the guest
+    memory like 0.9mem. More than one thread runs the throughput mode with
+    the file size split over the threads.
+
+    :param params: Dictionary with the kind specific test parameters
+    :param kind: iozone workload kind, a key of IOZONE_WORKLOADS
+    :param block_size: record size, like 64k
+    :param threads: number of threads
+    :param mem_kb: guest memory in kB
+    :return: the command line, relative to the iozone source directory
+    """
+    if kind not in IOZONE_WORKLOADS:
+        raise error.TestError("Unknown iozone workload '%s'" % kind)
+    file_size, direct = IOZONE_WORKLOADS[kind]
+    file_size = params.get("perf_file_size", file_size)
+    direct = params.get("perf_direct", direct)
+    if file_size.endswith("mem"):
+        file_size = "%dk" % (float(file_size[:-3]) * mem_kb)
+    location = params.get("perf_location", "/mnt")
+    cmd = "src/current/iozone -i 0 -i 1 -r %s -w -+u -R" % block_size
+    if direct == "yes":
+        cmd += " -I"
+    if threads > 1:
+        file_size = "%dk" % (float(utils_misc.normalize_data_size(
+            file_size, "K")) / threads)
+        files = ["%s/%s%s" % (location, kind, _) for _ in range(threads)]
+        cmd += " -s %s -t %s -F %s" % (file_size, threads, " ".join(files))
+    else:
+        cmd += " -a -s %s -f %s/%s" % (file_size, location, kind)
+    return cmd
+
+
+def sweep_points(params):
+    """
+    Get the cross product of workload kinds, block sizes and threads.
+
+    Every workload kind can override the block sizes and threads with
+    perf_block_sizes_<kind> and perf_threads_<kind>.
+
+    :param params: Dictionary with the test parameters
+    :return: list of (kind, block size, threads, kind params)
+    """
+    points = []
+    for kind in params.objects("perf_workloads"):
+        kind_params = params.object_params(kind)
+        for block_size in kind_params.objects("perf_block_sizes"):
+            for threads in kind_params.objects("perf_threads"):
+                points.append((kind, block_size, int(threads), kind_params))
+    return points
+
+
+def write_fio_job(params, filename):
+    """
+    Write the fio job file of the fio_jobs in params.
+
+    Every job runs after the previous one (stonewall) and its numjobs
+    clones are reported as one job (group_reporting). All jobs and clones
+    share one data file of fio_size, so the disk only needs room for it.
+
+    :param params: Dictionary with the test parameters
+    :param filename: path of the job file to write
+    """
+    percentiles = params.get("fio_percentiles", "50 90 99 99.9").split()
+    lines = ["[global]",
+             "ioengine=%s" % params.get("fio_ioengine", "libaio"),
+             "directory=%s" % params.get("fio_directory", "/mnt"),
+             "filename=%s" % params.get("fio_filename", "perf.fio.data"),
+             "size=%s" % params.get("fio_size", "4G"),
+             "runtime=%s" % params.get("fio_runtime", "60"),
+             "time_based",
+             "group_reporting",
+             "percentile_list=%s" % ":".join(percentiles)]
+    for job in params.objects("fio_jobs"):
+        job_params = params.object_params(job)
+        rw = job_params.get("fio_rw", "randread")
+        lines += ["", "[%s]" % job, "stonewall",
+                  "rw=%s" % rw,
+                  "bs=%s" % job_params.get("fio_bs", "4k"),
+                  "iodepth=%s" % job_params.get("fio_iodepth", "1"),
+                  "numjobs=%s" % job_params.get("fio_numjobs", "1"),
+                  "direct=%s" % job_params.get("fio_direct", "1")]
+        if rw in ("rw", "readwrite", "randrw"):
+            lines.append("rwmixread=%s" % job_params.get("fio_rwmixread",
+                                                         "50"))
+    job_file = open(filename, "w")
+    job_file.write("\n".join(lines) + "\n")
+    job_file.close()
+
+
 def run(test, params, env):
     """
     KVM performance test:
@@ -80,6 +334,18 @@ def run(test, params, env):
     but we can implement some special requests for performance
     testing.
 
+    Every run appends its result files to the results catalog of
+    result_dir, the summary looks the runs up there instead of walking the
+    results tree.
+
+    With perf_sweep = ffsb or iozone the ffsb profiles or iozone command
+    lines of the cross product of perf_workloads, perf_block_sizes and
+    perf_threads are generated and run one after another in the same
+    guest, every point in its own results directory.
+
+    With fio_jobs set, a fio job file is generated from the fio_* params
+    and copied to the guest; the summary reads the fio json output.
+
     :param test: QEMU test object
     :param params: Dictionary with the test parameters
     :param env: Dictionary with test environment.
@@ -88,9 +354,9 @@ def run(test, params, env):
     vm.verify_alive()
 
     test_timeout = int(params.get("test_timeout", 240))
-    monitor_cmd = params["monitor_cmd"]
+    monitor_interval = params.get("monitor_interval", 1)
     login_timeout = int(params.get("login_timeout", 360))
-    test_cmd = params["test_cmd"]
+    test_cmd = params.get("test_cmd")
     guest_path = params.get("result_path", "/tmp/guest_result")
     test_src = params["test_src"]
     test_patch = params.get("test_patch")
@@ -108,8 +374,8 @@ def run(test, params, env):
         session.close()
         return
 
-    guest_launcher = os.path.join(test.virtdir, "scripts/cmd_runner.py")
-    vm.copy_files_to(guest_launcher, "/tmp")
+    guest_agent = "%s.py" % os.path.splitext(proc_sampler.__file__)[0]
+    vm.copy_files_to(guest_agent, "/tmp/proc_sampler.py")
     md5value = params.get("md5value")
 
     tarball = utils.unmap_url_cache(test.tmpdir, test_src, md5value)
@@ -135,6 +401,12 @@ def run(test, params, env):
         vm.copy_files_to(test_patch_path, "/tmp/src")
         session.cmd("cd /tmp/src && patch -p1 < /tmp/src/%s" % test_patch)
 
+    if params.get("fio_jobs"):
+        fio_job_file = os.path.join(test.tmpdir,
+                                    params.get("fio_job_file", "perf.fio"))
+        write_fio_job(params, fio_job_file)
+        vm.copy_files_to(fio_job_file, "/tmp/src")
+
     compile_cmd = params.get("compile_cmd")
     if compile_cmd:
         session.cmd("cd /tmp/src && %s" % compile_cmd)
@@ -145,47 +417,59 @@ def run(test, params, env):
         if s != 0:
             raise error.TestError("Fail to prepare test env in guest")
 
-    cmd = "cd /tmp/src && python /tmp/cmd_runner.py \"%s &> " % monitor_cmd
-    cmd += "/tmp/guest_result_monitor\"  \"/tmp/src/%s" % test_cmd
-    cmd += " &> %s \" \"/tmp/guest_result\""
-    cmd += " %s" % int(test_timeout)
-
-    test_cmd = cmd
-    # Run guest test with monitor
-    tag = cmd_runner_monitor(vm, monitor_cmd, test_cmd,
-                             guest_path, timeout=test_timeout)
-
-    # Result collecting
-    result_list = ["/tmp/guest_result_%s" % tag,
-                   "/tmp/host_monitor_result_%s" % tag,
-                   "/tmp/guest_monitor_result_%s" % tag]
-    guest_results_dir = os.path.join(test.outputdir, "guest_results")
-    if not os.path.exists(guest_results_dir):
-        os.mkdir(guest_results_dir)
-    ignore_pattern = params.get("ignore_pattern")
-    head_pattern = params.get("head_pattern")
-    row_pattern = params.get("row_pattern")
-    for i in result_list:
-        if re.findall("monitor_result", i):
-            result = utils_test.summary_up_result(i, ignore_pattern,
-                                                  head_pattern, row_pattern)
-            fd = open("%s.sum" % i, "w")
-            sum_info = {}
-            head_line = ""
-            for keys in result:
-                head_line += "\t%s" % keys
-                for col in result[keys]:
-                    col_sum = "line %s" % col
-                    if col_sum in sum_info:
-                        sum_info[col_sum] += "\t%s" % result[keys][col]
-                    else:
-                        sum_info[col_sum] = "%s\t%s" % (col, result[keys][col])
-            fd.write("%s\n" % head_line)
-            for keys in sum_info:
-                fd.write("%s\n" % sum_info[keys])
-            fd.close()
-            shutil.copy("%s.sum" % i, guest_results_dir)
-        shutil.copy(i, guest_results_dir)
+    result_dir = params.get("result_dir", os.path.dirname(test.outputdir))
+
+    def run_guest_test(test_cmd, outputdir, threads=""):
+        """
+        Run test_cmd with the monitors and collect its results to outputdir
+        """
+        test_cmd = "cd /tmp/src && /tmp/src/%s &> %s" % (test_cmd, guest_path)
+        # Run guest test with monitor
+        tag = cmd_runner_monitor(vm, test_cmd, guest_path,
+                                 interval=monitor_interval,
+                                 timeout=test_timeout,
+                                 python=params.get("guest_python"))
+
+        # Result collecting
+        result_list = ["/tmp/guest_result_%s" % tag,
+                       "/tmp/host_monitor_result_%s" % tag,
+                       "/tmp/guest_monitor_result_%s" % tag]
+        guest_results_dir = os.path.join(outputdir, "guest_results")
+        if not os.path.exists(guest_results_dir):
+            os.makedirs(guest_results_dir)
+        for i in result_list:
+            shutil.copy(i, guest_results_dir)
+        catalog_add(result_dir, outputdir, guest_results_dir, threads)
+
+    perf_sweep = params.get("perf_sweep")
+    if perf_sweep:
+        # Every point runs in this session on the built test suite, its
+        # results go to <outputdir>/<perf_sweep>.<kind>_<size>_<threads>
+        mem_kb = int(session.cmd_output("awk '/MemTotal/ {print $2}' "
+                                        "/proc/meminfo"))
+        point_prepare_cmd = params.get("perf_point_prepare_cmd")
+        for kind, block_size, threads, kind_params in sweep_points(params):
+            point = "%s_%s_%02d" % (kind, block_size, threads)
+            logging.info("Run %s point %s", perf_sweep, point)
+            if perf_sweep == "ffsb":
+                profile = os.path.join(test.tmpdir, "%s.ffsb" % point)
+                profile_file = open(profile, "w")
+                profile_file.write(ffsb_profile(kind_params, kind,
+                                                block_size, threads))
+                profile_file.close()
+                vm.copy_files_to(profile, "/tmp/src/examples")
+                point_cmd = "ffsb examples/%s.ffsb" % point
+            elif perf_sweep == "iozone":
+                point_cmd = iozone_cmd(kind_params, kind, block_size,
+                                       threads, mem_kb)
+            else:
+                raise error.TestError("Unknown perf_sweep '%s'" % perf_sweep)
+            if point_prepare_cmd:
+                session.cmd(point_prepare_cmd, test_timeout)
+            run_guest_test(point_cmd, os.path.join(
+                test.outputdir, "%s.%s" % (perf_sweep, point)), threads)
+    else:
+        run_guest_test(test_cmd, test.outputdir)
 
     session.cmd("rm -rf /tmp/src")
     session.cmd("rm -rf guest_test*")
@@ -193,30 +477,6 @@ def run(test, params, env):
     session.close()
 
 
-def mpstat_ana(filename):
-    """
-    Get the cpu usage from the mpstat summary file
-
-    :param filename: filename of the mpstat summary file
-    """
-    mpstat_result = open(filename, 'r')
-    key_value = "%idle"
-    index = 0
-    result = {}
-    for line in mpstat_result.readlines():
-        if key_value in line:
-            index = line.split().index(key_value) + 1
-        else:
-            data = line.split()
-            if data[0] == "all":
-                vcpu = "all"
-            else:
-                vcpu = "vcpu%s" % data[0]
-            cpu_use = "%20.2f" % (100 - utils_misc.aton(data[index]))
-            result[vcpu] = cpu_use
-    return result
-
-
 def time_ana(results_tuple):
     """
     Get the time from the results when run test with time
@@ -234,6 +494,42 @@ def time_ana(results_tuple):
     return str(time_data)
 
 
+def fio_ana(filename, percentiles):
+    """
+    Get IOPS, bandwidth and clat percentiles from the fio json output
+
+    :param filename: filename of the fio --output-format=json output
+    :param percentiles: the clat percentiles to get, as strings
+    :return: list of (job-direction, [(tag, value), ...]) for every
+             direction a job did io in
+    """
+    fio_result = open(filename, 'r')
+    output = fio_result.read()
+    fio_result.close()
+    # Skip the warnings fio prints before the json document
+    output = json.JSONDecoder().raw_decode(output[output.index("{"):])[0]
+    results = []
+    for job in output["jobs"]:
+        for ddir in ("read", "write", "trim"):
+            stats = job.get(ddir)
+            if not stats or not stats.get("io_bytes",
+                                          stats.get("io_kbytes")):
+                continue
+            # fio >= 2.99 reports clat in ns, the older versions in us
+            if "clat_ns" in stats:
+                clat, scale = stats["clat_ns"], 1000.0
+            else:
+                clat, scale = stats["clat"], 1.0
+            tags = [("IOPS", float(stats["iops"])),
+                    ("BW-KBps", float(stats["bw"])),
+                    ("clat-mean-us", clat["mean"] / scale)]
+            for pct in percentiles:
+                value = clat["percentile"]["%f" % float(pct)]
+                tags.append(("clat-p%s-us" % pct, value / scale))
+            results.append((str("%s-%s" % (job["jobname"], ddir)), tags))
+    return results
+
+
 def format_result(result, base="20", fbase="2"):
     """
     Format the result to a fixed length string.
@@ -286,12 +582,40 @@ def result_sum(topdir, params, guest_ver, resultsdir, test):
     # Find the results files
 
     results_files = {}
-    file_list = ['guest_result', 'guest_monitor_result.*sum',
-                 'host_monitor_result.*sum']
+    file_list = ['guest_result', 'guest_monitor_result',
+                 'host_monitor_result']
     if params.get("file_list"):
         file_list = params.get("file_list").split()
 
-    for files in os.walk(topdir):
+    def add_result_file(prefix, dirpath, filename):
+        for i, pattern in enumerate(file_list):
+            if re.findall(pattern, filename):
+                if prefix not in results_files.keys():
+                    results_files[prefix] = [None] * len(file_list)
+                tmp_file = utils_misc.get_path(dirpath, filename)
+                results_files[prefix][i] = tmp_file
+
+    # The runs append their result files to the catalog, the prefix and the
+    # thread count of a run come from its record
+    results_threads = {}
+    records = catalog_query(topdir, case_type, repeatn)
+    for record in records:
+        record_dir = str(record["dir"])
+        if [_ for _ in ignore_cases if _ in record_dir]:
+            continue
+        if category_key not in re.sub("\.repeat\d+", "", record_dir):
+            continue
+        prefix = re.sub("\.|_", "--", str(record["category"]))
+        if record["threads"]:
+            results_threads[prefix] = "%02d" % int(record["threads"])
+        for file in record["files"]:
+            add_result_file(prefix, record_dir, str(file))
+
+    # Walk the whole tree only for results written by other tests
+    if not records:
+        logging.info("No %s run in the results catalog of %s, walk the "
+                     "whole results tree", case_type, topdir)
+    for files in (not records and os.walk(topdir) or []):
         if files[2]:
             for file in files[2]:
                 jump_flag = False
@@ -304,19 +628,20 @@ def result_sum(topdir, params, guest_ver, resultsdir, test):
                 if (repeatn in files[0]
                     and category_key in file_dir_norpt
                         and case_type in files[0]):
-                    for i, pattern in enumerate(file_list):
-                        if re.findall(pattern, file):
-                            prefix = re.findall("%s\.[\d\w_\.]+" % case_type,
-                                                file_dir_norpt)[0]
-                            prefix = re.sub("\.|_", "--", prefix)
-                            if prefix not in results_files.keys():
-                                results_files[prefix] = []
-                                tmp = []
-                                for j in range(len(file_list)):
-                                    tmp.append(None)
-                                results_files[prefix] = tmp
-                            tmp_file = utils_misc.get_path(files[0], file)
-                            results_files[prefix][i] = tmp_file
+                    prefix = re.findall("%s\.[\d\w_\.]+" % case_type,
+                                        file_dir_norpt)
+                    if not prefix:
+                        continue
+                    # The sweep points are <case_type>.<point> directories
+                    # below the outputdir, take the innermost case
+                    # directory for them
+                    point_dir = os.path.basename(os.path.dirname(files[0]))
+                    if point_dir.startswith("%s." % case_type):
+                        prefix = prefix[-1]
+                    else:
+                        prefix = prefix[0]
+                    prefix = re.sub("\.|_", "--", prefix)
+                    add_result_file(prefix, files[0], file)
 
     # Start to read results from results file and monitor file
     results_matrix = {}
@@ -332,7 +657,7 @@ def result_sum(topdir, params, guest_ver, resultsdir, test):
         prefix_perf = prefix
         if case_type == "ffsb":
             category = "-".join(case_infos[:-1])
-            threads = case_infos[-1]
+            threads = results_threads.get(prefix, case_infos[-1])
         elif case_type == "qcow2perf":
             refresh_order_list = False
             if len(case_infos) > 2:
@@ -348,7 +673,24 @@ def result_sum(topdir, params, guest_ver, resultsdir, test):
             category = "-".join(case_infos)
         if refresh_order_list:
             order_list = []
-        if (category not in results_matrix.keys()
+        row_dics = []
+        if case_type == "fio":
+            # One row per job and direction, the tags come from the json
+            # output instead of the marks
+            marks = []
+            percentiles = params.get("fio_percentiles",
+                                     "50 90 99 99.9").split()
+            for row, tags in fio_ana(results_files[prefix][0], percentiles):
+                tmp_dic = results_matrix.setdefault("%s-%s" % (category,
+                                                               row), {})
+                for tag, value in tags:
+                    tmp_dic[tag] = value
+                    if tag not in order_list:
+                        order_list.append(tag)
+                    test.write_perf_keyval({'%s-%s-%s' % (prefix_perf, row,
+                                                          tag): value})
+                row_dics.append(tmp_dic)
+        elif (category not in results_matrix.keys()
                 and category not in no_table_list):
             results_matrix[category] = {}
         if threads:
@@ -356,7 +698,7 @@ def result_sum(topdir, params, guest_ver, resultsdir, test):
                 results_matrix[category][threads] = {}
                 results_matrix["thread_tag"] = thread_tag
             tmp_dic = results_matrix[category][threads]
-        elif category not in no_table_list:
+        elif category in results_matrix:
             tmp_dic = results_matrix[category]
 
         result_context_file = open(results_files[prefix][0], 'r')
@@ -388,15 +730,19 @@ def result_sum(topdir, params, guest_ver, resultsdir, test):
                 order_list.append(mark_tag)
             test.write_perf_keyval({'%s-%s' % (prefix_perf, mark_tag):
                                     perf_value})
-        # start analyze the mpstat results
+        # start analyze the cpu usage of the monitor time series
         if params.get('mpstat') == "yes":
-            guest_cpu_infos = mpstat_ana(results_files[prefix][1])
-            for vcpu in guest_cpu_infos:
-                if vcpu != "all":
-                    tmp_dic[vcpu] = float(guest_cpu_infos[vcpu])
-                    order_list.append(vcpu)
-            host_cpu_infos = mpstat_ana(results_files[prefix][2])
-            tmp_dic["Hostcpu"] = float(host_cpu_infos["all"])
+            guest_cpu_infos = proc_sampler.series_mean(
+                results_files[prefix][1])
+            host_cpu_infos = proc_sampler.series_mean(
+                results_files[prefix][2])
+            vcpus = [_ for _ in guest_cpu_infos if re.match("cpu\d+$", _)]
+            vcpus.sort(key=lambda _: int(_[3:]))
+            for tmp_dic in row_dics or [tmp_dic]:
+                for vcpu in vcpus:
+                    tmp_dic["v%s" % vcpu] = guest_cpu_infos[vcpu]
+                tmp_dic["Hostcpu"] = host_cpu_infos["cpu"]
+            order_list += ["v%s" % _ for _ in vcpus]
             order_list.append("Hostcpu")
         # Add some special key for cases
         if case_type == "ffsb":
@@ -460,7 +806,8 @@ def result_sum(topdir, params, guest_ver, resultsdir, test):
                 write_out_loop = False
             else:
                 #line += "%s|" % format_result(results_matrix[category][item])
-                re_data = "DATA%s" % order_list.index(item)
+                # DATA1 must not match the start of DATA10
+                re_data = r"\bDATA%s\b" % order_list.index(item)
                 out_loop_line = re.sub(re_data,
                                        format_result(
                                            results_matrix[category][item]),
@@ -5,6 +5,53 @@ import os
 from autotest.client import utils
 from autotest.client.shared import error
 from virttest import remote, data_dir, utils_net, aexpect
+from provider import perf_report
+
+
+def get_pktgen_results(reader):
+    """
+    Parse the counters of every pktgen device in /proc/net/pktgen
+
+    :param reader: function running a command on the pktgen server and
+                   returning its output
+    :return: dict of device to dict of pkts, errors and usec
+    """
+    output = reader("grep -H -e 'pkts-sofar:' -e 'Result: OK:' "
+                    "/proc/net/pktgen/* || true")
+    results = {}
+    for path, pkts, errors in re.findall(
+            r"^/proc/net/pktgen/(\S+):\s+pkts-sofar:\s+(\d+)\s+"
+            r"errors:\s+(\d+)", output, re.M):
+        results[path] = {"pkts": int(pkts), "errors": int(errors),
+                         "usec": 0}
+    for path, usec in re.findall(
+            r"^/proc/net/pktgen/(\S+):Result: OK: (\d+)\(", output, re.M):
+        if path in results:
+            results[path]["usec"] = int(usec)
+    return results
+
+
+def get_if_counters(reader, ifname, counters):
+    """
+    Read the statistics counters of an interface
+
+    :param reader: function running a command and returning its output
+    :param ifname: interface name
+    :param counters: counter names in /sys/class/net/<ifname>/statistics
+    :return: dict of counter to value
+    """
+    cmd = ";".join(["cat /sys/class/net/%s/statistics/%s" % (ifname, _)
+                    for _ in counters])
+    return dict(zip(counters, [int(_) for _ in reader(cmd).split()]))
+
+
+def get_softnet_drops(reader):
+    """
+    Sum of the backlog drops of all cpus in /proc/net/softnet_stat
+    """
+    output = reader("cat /proc/net/softnet_stat")
+    return sum([int(line.split()[1], 16) for line in output.splitlines()
+                if line.strip()])
 
 
 @error.context_aware
@@ -16,6 +63,8 @@ def run(test, params, env):
     2) Configure pktgen server(only linux)
     3) Run pktgen test, finish when timeout or env["pktgen_run"] != True
 
+    With pktgen_sweep = yes step 3 sweeps pktgen threads and packet sizes.
+
     :param test: QEMU test object.
     :param params: Dictionary with the test parameters.
     :param env: Dictionary with test environment.
@@ -44,6 +93,7 @@ def run(test, params, env):
         vm_pktgen.verify_alive()
         server_session = vm_pktgen.wait_for_login(timeout=login_timeout)
         runner = server_session.cmd_output_safe
+        reader = server_session.cmd_output
         pktgen_ip = vm_pktgen.get_address()
         pktgen_mac = vm_pktgen.get_mac_address()
         server_interface = utils_net.get_linux_ifname(server_session,
@@ -55,6 +105,7 @@ def run(test, params, env):
                                                s_shell_port, s_username,
                                                s_passwd, s_shell_prompt)
         runner = server_session.cmd_output_safe
+        reader = server_session.cmd_output
         server_interface = params.get("server_interface")
         if not server_interface:
             raise error.TestNAError("Must config server interface before test")
@@ -65,6 +116,7 @@ def run(test, params, env):
         pktgen_ip = host_nic.get_ip()
         pktgen_mac = host_nic.get_mac()
         runner = utils.system
+        reader = utils.system_output
 
     # copy pktgen_test scipt to the test server.
     local_path = os.path.join(data_dir.get_root_dir(),
@@ -73,6 +125,16 @@ def run(test, params, env):
     remote.scp_to_remote(pktgen_ip, s_shell_port, s_username, s_passwd,
                          local_path, remote_path)
 
+    if params.get("pktgen_sweep", "no") == "yes":
+        try:
+            pktgen_sweep(test, params, vm, session, reader, server_interface,
+                         pktgen_ip, s_shell_port, s_username, s_passwd)
+        finally:
+            if server_session:
+                server_session.close()
+            session.close()
+        return
+
     error.context("Run pktgen test")
     run_threads = params.get("pktgen_threads", 1)
     pktgen_stress_timeout = float(params.get("pktgen_test_timeout", 600))
@@ -95,7 +157,94 @@ def run(test, params, env):
     finally:
         env["pktgen_run"] = False
 
+    for device, result in get_pktgen_results(reader).items():
+        if result["usec"]:
+            logging.info("pktgen %s sent %s packets, %d pps, errors %s",
+                         device, result["pkts"],
+                         result["pkts"] * 1000000 / result["usec"],
+                         result["errors"])
+
     if server_session:
         server_session.close()
     if session:
         session.close()
+
+
+def pktgen_sweep(test, params, vm, session, reader, server_interface,
+                 pktgen_ip, shell_port, username, password):
+    """
+    Sweep pktgen threads and packet sizes towards the vm
+
+    :param vm: the receiver vm
+    :param session: receiver vm session
+    :param reader: function running a command on the pktgen server and
+                   returning its output
+    :param server_interface: pktgen server interface to send from
+    """
+    local_path = os.path.join(data_dir.get_deps_dir("pktgen"),
+                              "pktgen_pps.sh")
+    remote_path = "/tmp/pktgen_pps.sh"
+    remote.scp_to_remote(pktgen_ip, shell_port, username, password,
+                         local_path, remote_path)
+
+    ncpu = int(reader("grep -c ^processor /proc/cpuinfo").strip())
+    guest_ifname = utils_net.get_linux_ifname(session, vm.get_mac_address())
+    tap = vm.get_ifname(0)
+    count = int(params.get("pktgen_count", 1000000))
+    clone_skb = params.get("pktgen_clone_skb", "0")
+    timeout = float(params.get("pktgen_test_timeout", 600))
+    session.cmd("iptables -F", ignore_all_errors=True)
+
+    def get_state():
+        state = get_if_counters(reader, server_interface, ["tx_dropped"])
+        state["tap_dropped"] = get_if_counters(utils.system_output, tap,
+                                               ["tx_dropped"])["tx_dropped"]
+        state.update(get_if_counters(session.cmd_output, guest_ifname,
+                                     ["rx_packets", "rx_dropped"]))
+        state["backlog_dropped"] = get_softnet_drops(session.cmd_output)
+        return state
+
+    table = perf_report.ResultTable(test, "pktgen-pps",
+                                    ["threads", "size", "sent_pps",
+                                     "recv_pps", "pktgen_err", "nic_tx_drop",
+                                     "tap_drop", "guest_drop",
+                                     "backlog_drop"])
+    for threads in params.get("pktgen_sweep_threads", "1 2 4").split():
+        if int(threads) > ncpu:
+            logging.warn("Skip %s pktgen threads, server only has %s cpus",
+                         threads, ncpu)
+            continue
+        for size in params.get("pktgen_sweep_sizes", "60 512 1500").split():
+            error.context("Run pktgen with %s threads and size %s" %
+                          (threads, size), logging.info)
+            before = get_state()
+            reader("%s %s %s %s %s %s %s %s" % (remote_path, vm.get_address(),
+                                                vm.get_mac_address(),
+                                                server_interface, threads,
+                                                size, count, clone_skb),
+                   timeout=timeout)
+            # let the receiver drain its queues before reading the counters
+            time.sleep(1)
+            after = get_state()
+
+            devices = [result for device, result in
+                       get_pktgen_results(reader).items()
+                       if device.startswith("%s@" % server_interface)]
+            usec = max([_["usec"] for _ in devices] + [0])
+            if not usec:
+                raise error.TestError("Fail to get pktgen result of %s "
+                                      "threads size %s" % (threads, size))
+            sent = sum([_["pkts"] for _ in devices])
+            received = after["rx_packets"] - before["rx_packets"]
+            row = {"threads": int(threads), "size": int(size),
+                   "sent_pps": sent * 1000000.0 / usec,
+                   "recv_pps": received * 1000000.0 / usec,
+                   "pktgen_err": sum([_["errors"] for _ in devices]),
+                   "nic_tx_drop": after["tx_dropped"] - before["tx_dropped"],
+                   "tap_drop": after["tap_dropped"] - before["tap_dropped"],
+                   "guest_drop": after["rx_dropped"] - before["rx_dropped"],
+                   "backlog_drop": (after["backlog_dropped"] -
+                                    before["backlog_dropped"])}
+            table.add(row, "threads-%s--size-%s" % (threads, size),
+                      table.keys[2:])
+    table.log("pktgen packet rates")
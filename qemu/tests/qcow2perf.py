@@ -1,10 +1,30 @@
 import re
+import os
 import logging
 import time
 from autotest.client.shared import error
-from virttest import qemu_io, data_dir
+from virttest import qemu_io, data_dir, utils_misc
 from virttest.qemu_storage import QemuImg
 from autotest.client import utils
+from provider import perf_stats, perf_report
+
+MATRIX_AXES = ["cluster_size", "preallocation", "lazy_refcounts", "cache",
+               "chain_depth", "op"]
+
+
+def timed_run(cmd):
+    """
+    Run cmd and return its elapsed, user and sys seconds.
+
+    user and sys are the cpu times of the waited children, so they cover
+    every process of a shell pipeline.
+    """
+    start = os.times()
+    start_time = time.time()
+    utils.run(cmd)
+    elapsed = time.time() - start_time
+    end = os.times()
+    return elapsed, end[2] - start[2], end[3] - start[3]
 
 
 @error.context_aware
@@ -16,10 +36,19 @@ def run(test, params, env):
     3. Do one operations to the image and measure the time
     4. Record the results
 
+    With qcow2perf_matrix = yes the op runs for every cell of the cross
+    product of cluster_size, preallocation, lazy_refcounts, cache mode,
+    backing chain depth and op, matrix_repeat times each. Elapsed, user and
+    sys seconds are recorded as mean/stdev/min per cell in one table.
+
     :param test:   QEMU test object
     :param params: Dictionary with the test parameters
     :param env:    Dictionary with test environment.
     """
+    if params.get("qcow2perf_matrix", "no") == "yes":
+        qcow2perf_matrix(test, params)
+        return
+
     image_chain = params.get("image_chain")
     test_image = int(params.get("test_image", "0"))
     interval_size = params.get("interval_szie", "64k")
@@ -106,3 +135,157 @@ def run(test, params, env):
     result_file.write("%s:%s\n" % (op_type, output))
     logging.info("%s takes %s" % (op_type, output))
     result_file.close()
+
+
+def qcow2perf_matrix(test, params):
+    """
+    Run the qcow2 image option matrix
+
+    :param test: QEMU test object
+    :param params: Dictionary with the test parameters
+    """
+    qemu_img = utils_misc.get_qemu_img_binary(params)
+    qemu_io_bin = utils_misc.get_qemu_io_binary(params)
+    image_dir = os.path.join(data_dir.get_data_dir(), "images")
+    image_size = params.get("matrix_image_size", "8G")
+    read_size = params.get("matrix_read_size", "1G")
+    repeat = int(params.get("matrix_repeat", 3))
+    writecmd = params.get("writecmd")
+    write_round = int(params.get("write_round", "16384"))
+    interval_size = params.get("interval_szie", "64k")
+    if not re.match(r"\d+", interval_size[-1]):
+        write_unit = interval_size[-1]
+        interval_size = int(interval_size[:-1])
+    else:
+        interval_size = int(interval_size)
+        write_unit = ""
+    dropcache = 'echo 3 > /proc/sys/vm/drop_caches && sleep 5'
+    write_pass = writecmd % (write_round, 0, interval_size, write_unit,
+                             interval_size, write_unit)
+
+    def image_path(name):
+        return os.path.join(image_dir, "qcow2perf-%s.qcow2" % name)
+
+    def create_image(path, options, backing=None, size=image_size):
+        opts = ("compat=1.1,cluster_size=%s,preallocation=%s,"
+                "lazy_refcounts=%s" % options)
+        if backing:
+            opts += ",backing_file=%s,backing_fmt=qcow2" % backing
+            # preallocation is not supported with a backing file
+            opts = re.sub(r"preallocation=\w+,", "", opts)
+        utils.run("%s create -f qcow2 -o %s %s %s" % (qemu_img, opts,
+                                                      path, size))
+
+    def write_image(path, cache):
+        return "%s | %s -t %s %s > /dev/null" % (write_pass, qemu_io_bin,
+                                                 cache, path)
+
+    bases = {}
+
+    def get_base(options):
+        """
+        Create and write the base image of options once
+        """
+        if options not in bases:
+            path = image_path("base-%s-%s-%s" % options)
+            error.context("Prepare base image %s" % path, logging.info)
+            create_image(path, options)
+            utils.run(write_image(path, "writeback"))
+            bases[options] = path
+        return bases[options]
+
+    def run_cell(options, cache, depth, op):
+        """
+        Run one repetition of a cell
+
+        :return: tuple of elapsed, user and sys seconds
+        """
+        base = get_base(options)
+        chain = [base]
+        for i in range(depth):
+            chain.append(image_path("sn%s" % (i + 1)))
+            create_image(chain[-1], options, backing=chain[-2])
+        top = chain[-1]
+        if op == "write":
+            if not depth:
+                # never write to the shared base
+                top = image_path("write")
+                create_image(top, options)
+            cmd = write_image(top, cache)
+        elif op == "read":
+            cmd = "echo read 0 %s | %s -r -t %s %s > /dev/null" % (
+                read_size, qemu_io_bin, cache, top)
+        elif op == "convert":
+            cmd = "%s convert -f qcow2 -O qcow2 -t %s %s %s" % (
+                qemu_img, cache, top, image_path("convert"))
+        elif op == "commit":
+            utils.run(write_image(top, "writeback"))
+            cmd = "%s commit -f qcow2 -t %s %s" % (qemu_img, cache, top)
+        elif op == "rebase":
+            new_base = image_path("newbase-%s-%s-%s" % options)
+            if not os.path.exists(new_base):
+                create_image(new_base, options)
+            cmd = "%s rebase -f qcow2 -F qcow2 -t %s -b %s %s" % (
+                qemu_img, cache, new_base, top)
+        else:
+            raise error.TestError("Unknown qcow2perf op '%s'" % op)
+        try:
+            utils.run(dropcache)
+            return timed_run(cmd)
+        finally:
+            names = ["sn%s" % (i + 1) for i in range(depth)]
+            for name in ["write", "convert"] + names:
+                if os.path.exists(image_path(name)):
+                    os.unlink(image_path(name))
+
+    axes = [params.get("matrix_%s" % _, "").split() for _ in MATRIX_AXES]
+    cells = [[]]
+    for values in axes:
+        cells = [cell + [value] for cell in cells for value in values]
+
+    stats = ["elapsed", "user", "sys"]
+    keys = MATRIX_AXES + ["%s_%s" % (stat, _) for stat in stats
+                          for _ in ("mean", "stdev", "min")]
+    table = perf_report.ResultTable(test, "qcow2perf_matrix", keys,
+                                    base="14", fbase="3")
+    failed = []
+    try:
+        for cell in cells:
+            row = dict(zip(MATRIX_AXES, cell))
+            options = (row["cluster_size"], row["preallocation"],
+                       row["lazy_refcounts"])
+            depth = int(row["chain_depth"])
+            # commit would change the shared base, rebase needs a backing
+            if row["op"] in ("commit", "rebase") and depth < (
+                    row["op"] == "commit" and 2 or 1):
+                logging.info("Skip %s with chain depth %s", row["op"], depth)
+                continue
+            error.context("Run %s" % " ".join(cell), logging.info)
+            try:
+                samples = [run_cell(options, row["cache"], depth, row["op"])
+                           for _ in range(repeat)]
+            except error.CmdError, detail:
+                # keep the rest of the matrix, the cell is recorded as "-"
+                logging.error("Cell %s failed: %s", " ".join(cell), detail)
+                failed.append(" ".join(cell))
+                samples = []
+            for index, stat in enumerate(stats):
+                values = [_[index] for _ in samples]
+                if not values:
+                    for name in ("mean", "stdev", "min"):
+                        row["%s_%s" % (stat, name)] = "-"
+                    continue
+                row["%s_mean" % stat] = perf_stats.mean(values)
+                row["%s_stdev" % stat] = perf_stats.stdev(values)
+                row["%s_min" % stat] = min(values)
+            table.add(row, "-".join(cell), keys[len(MATRIX_AXES):])
+    finally:
+        for path in bases.values() + [image_path("newbase-%s-%s-%s" % _)
+                                      for _ in bases]:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    table.log("qcow2perf matrix (seconds)")
+    if failed:
+        raise error.TestFail("qcow2perf failed for %s of %s cells: %s" %
+                             (len(failed), len(cells), "; ".join(failed)))
@@ -1,9 +1,23 @@
 import logging
 import os
 import re
+import time
 from autotest.client import utils
 from autotest.client.shared import error
 from virttest import remote, utils_misc, utils_net
+from provider import perf_stats, perf_report
+
+PARITY_STREAM = ["THROUGHPUT", "LOCAL_CPU_UTIL", "REMOTE_CPU_UTIL"]
+PARITY_RR = ["TRANSACTION_RATE", "MEAN_LATENCY", "P99_LATENCY",
+             "LOCAL_CPU_UTIL", "REMOTE_CPU_UTIL"]
+# ethtool -k names of the ethtool -K offload features
+OFFLOAD_PATTERN = {"tx": "tx.*checksumming",
+                   "rx": "rx.*checksumming",
+                   "sg": "scatter.*gather",
+                   "tso": "tcp.*segmentation.*offload",
+                   "gso": "generic.*segmentation.*offload",
+                   "gro": "generic.*receive.*offload",
+                   "lro": "large.*receive.*offload"}
 
 
 @error.context_aware
@@ -13,6 +27,8 @@ def run(test, params, env):
         1. boot up two virtual machine
         2. Transfer data: host <--> guest1 <--> guest2 <-->host via ipv6
         3. after data transfer, check data have no change
+
+    With ip_parity = yes steps 2 and 3 compare IPv4 and IPv6 performance.
     Params:
         :param test: QEMU test object
         :param params: Dictionary with the test parameters
@@ -79,6 +95,14 @@ def run(test, params, env):
         addresses[vm] = get_linux_ipv6_linklocal_address(inet_name[vm],
                                                          sessions[vm])
 
+    if params.get("ip_parity", "no") == "yes":
+        try:
+            ip_parity(test, params, vms, sessions, inet_name, addresses)
+        finally:
+            for vm in vms:
+                sessions[vm].close()
+        return
+
     # prepare test data
     guest_path = (tmp_dir + "src-%s" % utils_misc.generate_random_string(8))
     dest_path = (tmp_dir + "dst-%s" % utils_misc.generate_random_string(8))
@@ -144,3 +168,140 @@ def run(test, params, env):
             sessions[vm].cmd("rm -rf %s %s || true" % (guest_path, dest_path),
                              timeout=timeout, ignore_all_errors=True)
             sessions[vm].close()
+
+
+def ip_parity(test, params, vms, sessions, inet_name, addresses):
+    """
+    Compare IPv4 and IPv6 performance from vms[0] to vms[1] on one nic
+
+    :param sessions: dict of vm to session
+    :param inet_name: dict of vm to guest interface name
+    :param addresses: dict of vm to ipv6 link local address
+    """
+    client_vm, server_vm = vms[:2]
+    username = params.get("username")
+    password = params.get("password")
+    port = params.get("file_transfer_port")
+    targets = {"ipv4": server_vm.get_address(),
+               "ipv6": "%s%%%s" % (addresses[server_vm],
+                                   inet_name[client_vm])}
+    rounds = int(params.get("ip_parity_rounds", 3))
+    test_time = params.get("ip_parity_time", "30")
+    filesize = int(params.get("filesize", 4096))
+    features = params.get("ip_parity_offload_features", "tx rx tso")
+    file_trans_timeout = int(params.get("file_trans_timeout", 1200))
+    src_path = "/tmp/ip_parity_src"
+    empty_path = "/tmp/ip_parity_empty"
+    dst_path = "/tmp/ip_parity_dst"
+
+    netperf_server, netperf_client = perf_report.netperf_pair(
+        params, server_vm.get_address(), client_vm.get_address())
+
+    def get_offloads(vm):
+        """
+        Get the ethtool -k state of the offload features of vm
+        """
+        output = sessions[vm].cmd_output("ethtool -k %s" % inet_name[vm])
+        state = {}
+        for feature in features.split():
+            value = re.findall(r"%s: (on|off)" %
+                               OFFLOAD_PATTERN.get(feature, feature), output)
+            if value:
+                state[feature] = value[0]
+        return state
+
+    def set_offloads(vm, state, ignore_all_errors=False):
+        """
+        Set the offload features of vm
+
+        :param state: dict of feature to "on" or "off"
+        """
+        if state:
+            options = " ".join(["%s %s" % _ for _ in sorted(state.items())])
+            sessions[vm].cmd("ethtool -K %s %s" % (inet_name[vm], options),
+                             ignore_all_errors=ignore_all_errors)
+
+    def run_netperf(proto, option, selectors):
+        global_opts = "-l %s" % test_time
+        if proto == "ipv6":
+            global_opts += " -6"
+        return perf_report.netperf_keyvals(netperf_client, targets[proto],
+                                           "%s %s" % (global_opts, option),
+                                           selectors)
+
+    def scp_time(proto, path):
+        start_time = time.time()
+        remote.scp_between_remotes(client_vm.get_address(), targets[proto],
+                                   port, password, password, username,
+                                   username, path, dst_path,
+                                   timeout=file_trans_timeout)
+        return time.time() - start_time
+
+    def run_round(proto):
+        """
+        Run the scp and netperf points once over proto
+        """
+        result = {}
+        # the time of an empty file copy is the login and ssh setup time
+        elapsed = scp_time(proto, src_path) - scp_time(proto, empty_path)
+        result["scp_mbps"] = filesize * 8 / max(elapsed, 0.001)
+        values = run_netperf(proto, "-c -C -t TCP_STREAM", PARITY_STREAM)
+        result["stream_thu"] = values["THROUGHPUT"]
+        result["stream_cpu"] = (values["LOCAL_CPU_UTIL"] +
+                                values["REMOTE_CPU_UTIL"])
+        # -j keeps the latency statistics of the -k selectors
+        values = run_netperf(proto, "-c -C -j -t TCP_RR", PARITY_RR)
+        result["rr_rate"] = values["TRANSACTION_RATE"]
+        result["rr_lat_mean"] = values["MEAN_LATENCY"]
+        result["rr_lat_p99"] = values["P99_LATENCY"]
+        result["rr_cpu"] = values["LOCAL_CPU_UTIL"] + values["REMOTE_CPU_UTIL"]
+        return result
+
+    metrics = ["scp_mbps", "stream_thu", "stream_cpu", "rr_rate",
+               "rr_lat_mean", "rr_lat_p99", "rr_cpu"]
+    table = perf_report.ResultTable(test, "ip-parity",
+                                    ["offloads", "metric", "ipv4", "ipv6",
+                                     "delta_pct", "significant"])
+    sessions[client_vm].cmd(params.get("dd_cmd") % (src_path, filesize),
+                            timeout=file_trans_timeout)
+    sessions[client_vm].cmd("touch %s" % empty_path)
+    orig_offloads = dict([(vm, get_offloads(vm)) for vm in vms[:2]])
+    try:
+        netperf_server.start()
+        for state in params.get("ip_parity_offloads", "on off").split():
+            error.context("Set offloads %s to %s" % (features, state),
+                          logging.info)
+            for vm in vms[:2]:
+                set_offloads(vm, dict([(_, state)
+                                       for _ in features.split()]))
+            samples = {"ipv4": [], "ipv6": []}
+            for i in range(rounds):
+                # alternate the order so drift hits both protocols alike
+                order = ["ipv4", "ipv6"]
+                if i % 2:
+                    order.reverse()
+                for proto in order:
+                    error.context("Round %s over %s with offloads %s" %
+                                  (i, proto, state), logging.info)
+                    samples[proto].append(run_round(proto))
+            for metric in metrics:
+                before = [_[metric] for _ in samples["ipv4"]]
+                after = [_[metric] for _ in samples["ipv6"]]
+                diff, significant = perf_stats.paired_t_test(before, after)
+                row = {"offloads": state, "metric": metric,
+                       "ipv4": perf_stats.mean(before),
+                       "ipv6": perf_stats.mean(after),
+                       "significant": significant and "yes" or "no"}
+                row["delta_pct"] = diff * 100 / (row["ipv4"] or 1)
+                table.add(row, "offloads-%s--%s" % (state, metric),
+                          table.keys[2:])
+    finally:
+        for vm in vms[:2]:
+            set_offloads(vm, orig_offloads[vm], ignore_all_errors=True)
+        perf_report.netperf_cleanup(netperf_server, netperf_client)
+        for vm in vms[:2]:
+            sessions[vm].cmd("rm -f %s %s %s" % (src_path, empty_path,
+                                                 dst_path),
+                             ignore_all_errors=True)
+
+    table.log("IPv4 vs IPv6 (Mbit/s, % cpu, us)")
@@ -1,7 +1,8 @@
 import logging
 from autotest.client import utils
 from autotest.client.shared import error
-from virttest import remote, utils_misc, utils_test
+from virttest import remote, utils_misc, utils_test, env_process
+from provider import perf_report
 
 
 @error.context_aware
@@ -13,6 +14,8 @@ def run(test, params, env):
     2. Transfer file between host and guest (by tcp,udp or both).
     3. Run netperf_udp with burst, check the guest works well.
 
+    With sndbuf_sweep = yes, sweep the tap sndbuf of two guests instead.
+
     Params:
         :param test: QEMU test object.
         :param params: Dictionary with the test parameters.
@@ -38,6 +41,90 @@ def run(test, params, env):
         if status:
             raise error.TestError("Setup udt on guest failed: '%s'" % output)
 
+    def tap_drops(taps):
+        """
+        Sum of rx and tx drops of the tap devices on host
+        """
+        drops = 0
+        for tap in taps:
+            for counter in ("rx_dropped", "tx_dropped"):
+                path = "/sys/class/net/%s/statistics/%s" % (tap, counter)
+                counter_file = open(path)
+                try:
+                    drops += int(counter_file.read())
+                finally:
+                    counter_file.close()
+        return drops
+
+    def boot_pair(vm_names, sndbuf):
+        """
+        Reboot the guests with the tap sndbuf of nic1
+        """
+        params_sndbuf = params.copy()
+        params_sndbuf["netdev_extra_params_nic1"] = ",sndbuf=%s" % sndbuf
+        params_sndbuf["start_vm"] = "yes"
+        for vm_name in vm_names:
+            vm = env.get_vm(vm_name)
+            if vm:
+                vm.destroy(gracefully=False)
+        pair = []
+        for vm_name in vm_names:
+            env_process.preprocess_vm(test, params_sndbuf, env, vm_name)
+            vm = env.get_vm(vm_name)
+            vm.verify_alive()
+            session = vm.wait_for_login(timeout=timeout)
+            session.cmd("iptables -F", ignore_all_errors=True)
+            session.close()
+            pair.append(vm)
+        return pair
+
+    def sndbuf_point(client_vm, server_vm):
+        """
+        Run TCP_STREAM and TCP_RR from client_vm to server_vm
+
+        :return: dict of throughput, latency and host drops of the point
+        """
+        server_ip = server_vm.get_address()
+        netperf_server, netperf_client = perf_report.netperf_pair(
+            params, server_ip, client_vm.get_address())
+        taps = [client_vm.get_ifname(0), server_vm.get_ifname(0)]
+        test_time = params.get("sndbuf_sweep_time", "30")
+        try:
+            netperf_server.start()
+            drops = tap_drops(taps)
+            result = {"throughput": perf_report.netperf_throughput(
+                netperf_client, server_ip, test_time,
+                size=params.get("sndbuf_sweep_stream_size", "16384"))}
+            result.update(perf_report.netperf_latency(
+                netperf_client, server_ip, test_time,
+                size=params.get("sndbuf_sweep_rr_size", "1")))
+            result["drops"] = tap_drops(taps) - drops
+            return result
+        finally:
+            perf_report.netperf_cleanup(netperf_server, netperf_client)
+
+    def sndbuf_sweep():
+        """
+        Sweep the tap sndbuf and record one curve table
+        """
+        vm_names = params.get("vms").split()[:2]
+        table = perf_report.ResultTable(test, "sndbuf-sweep",
+                                        ["sndbuf", "throughput", "lat_mean",
+                                         "lat_p99", "drops"])
+        for sndbuf in params.get("sndbuf_sweep_sizes",
+                                 "65536 1048576 unlimited").split():
+            # qemu does not limit the tap send buffer for sndbuf=0
+            value = sndbuf
+            if sndbuf == "unlimited":
+                value = 0
+            error.context("Boot guests with sndbuf=%s" % value, logging.info)
+            client_vm, server_vm = boot_pair(vm_names, value)
+            error.context("Run netperf with sndbuf=%s" % value, logging.info)
+            result = sndbuf_point(client_vm, server_vm)
+            result["sndbuf"] = sndbuf
+            table.add(result, "sndbuf-%s" % sndbuf)
+        table.log("Tap sndbuf sweep")
+
     timeout = int(params.get("login_timeout", '360'))
     transfer_timeout = int(params.get("transfer_timeout", '120'))
     password = params.get("password")
@@ -55,6 +142,10 @@ def run(test, params, env):
     filesize = int(params.get("filesize", '100'))
     dd_cmd = params.get("dd_cmd", "dd if=/dev/urandom of=%s bs=1M count=%d")
 
+    if params.get("sndbuf_sweep", "no") == "yes":
+        sndbuf_sweep()
+        return
+
     sessions = []
     addresses = []
     vms = []
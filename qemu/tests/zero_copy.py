@@ -2,6 +2,8 @@ import logging
 from autotest.client import utils
 from autotest.client.shared import error
 from virttest import env_process, utils_test
+from generic.tests import netperf
+from provider import perf_report, perf_stats
 
 
 @error.context_aware
@@ -13,6 +15,11 @@ def run(test, params, env):
     3) Run the ping test, check guest nic works.
     4) check vm is alive have no crash
 
+    With zerocp_benchmark = yes the test is a paired benchmark instead: the
+    netperf matrix is run zerocp_rounds times with zero copy off and on, in
+    alternating order to cancel drift, and throughput, host CPU per Gbit,
+    vhost thread CPU and a paired t-test verdict are reported per point.
+
     :param test: QEMU test object.
     :param params: Dictionary with the test parameters.
     :param env: Dictionary with test environment.
@@ -42,6 +49,69 @@ def run(test, params, env):
         if utils.system(cmd) or enable != zerocp_enable_status():
             raise error.TestNAError("Set vhost_net zcopytx failed")
 
+    def netperf_trial(enable):
+        """
+        Boot the vm with zero copy on/off and run the netperf matrix.
+
+        :return: dict of (protocol, size, sessions) to netperf result
+        """
+        vm = env.get_vm(params["main_vm"])
+        if vm:
+            # vhost_net can only be reloaded when no vm uses it
+            vm.destroy(gracefully=False)
+        error.context("Run netperf with zero copy %s" %
+                      (enable and "on" or "off"), logging.info)
+        enable_zerocopytx_in_host(enable)
+        params_trial = params.copy()
+        params_trial["vhost"] = "vhost=on"
+        params_trial["start_vm"] = "yes"
+        env_process.preprocess_vm(test, params_trial, env,
+                                  params["main_vm"])
+        records = netperf.run(test, params_trial, env)
+        return dict([((p, i, j), ret) for p, i, j, ret in records])
+
+    def zerocp_benchmark():
+        rounds = int(params.get("zerocp_rounds", 3))
+        trials = {False: [], True: []}
+        for index in range(rounds):
+            # off/on, on/off, ... so a drift hits both settings alike
+            for enable in [(index % 2 == 1), (index % 2 == 0)]:
+                trials[enable].append(netperf_trial(enable))
+
+        error.context("Compare zero copy off and on", logging.info)
+        keys = ["point", "off_thu", "on_thu", "delta_pct", "off_cpu_per_gb",
+                "on_cpu_per_gb", "off_vhost_pct", "on_vhost_pct", "verdict"]
+        table = perf_report.ResultTable(test, "zerocopy-ab", keys,
+                                        base="16")
+        for point in sorted(trials[False][0].keys()):
+            row = {"point": "--".join(point)}
+            thu = {}
+            for enable, tag in ((False, "off"), (True, "on")):
+                rets = [_[point] for _ in trials[enable]]
+                thu[tag] = [float(_['thu']) for _ in rets]
+                row["%s_thu" % tag] = perf_stats.mean(thu[tag])
+                # thu is in 10^6bits/s, CPU in percent of the host
+                row["%s_cpu_per_gb" % tag] = perf_stats.mean(
+                    [_['CPU'] * 1000 / float(_['thu']) for _ in rets])
+                row["%s_vhost_pct" % tag] = perf_stats.mean(
+                    [100 * _.get('vhost_sec', 0) / _.get('cpu_window', 1)
+                     for _ in rets])
+            diff, significant = perf_stats.paired_t_test(thu["off"],
+                                                         thu["on"])
+            row["delta_pct"] = diff * 100 / row["off_thu"]
+            if not significant:
+                row["verdict"] = "no-difference"
+            elif diff > 0:
+                row["verdict"] = "on-better"
+            else:
+                row["verdict"] = "off-better"
+            table.add(row, "zerocp--%s" % row["point"])
+        table.log("Zero copy off/on comparison")
+
+    if params.get("zerocp_benchmark", "no") == "yes":
+        zerocp_benchmark()
+        return
+
     error.context("Set host vhost_net experimental_zcopytx", logging.info)
     if params.get("enable_zerocp", 'yes') == 'yes':
         enable_zerocopytx_in_host()